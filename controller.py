@@ -1,10 +1,32 @@
-from PyQt5.QtCore import QObject, pyqtSlot, QDateTime
+import time
+from PyQt5.QtCore import QObject, pyqtSlot, QDateTime, QTimer
 from PyQt5.QtWidgets import QWidget
 from pandas import Timestamp
-from view import Task, Shelf, Rack, Stage
+from view import Task, Shelf, Rack, Stage, ShelfTasks, ShelfPlaceholder
+from tood import is_binary_path
+from worker import SaveJob, LoadJob
 
 
 class Controller(QObject):
+    # seconds without changes after which a changed board is saved on its own
+    autosave_idle_seconds = 30
+    # changes after which a changed board is saved on its own, even while it is still being changed
+    autosave_change_limit = 200
+    # milliseconds between checks for an autosave
+    autosave_interval = 1000
+    # debug mode checking every instance lookup against a search of the whole nesting tree
+    check_instances = False
+    # seconds a tree stays collapsed before its child widgets are torn down, None to keep them
+    collapsed_teardown_seconds = None
+    # seconds spent building widgets of a loaded board before handing control back to the event loop
+    build_slice_seconds = 0.02
+    # tasks from which a shelf shows them as painted rows instead of task widgets, None to always use widgets
+    virtual_shelf_tasks = 500
+    # pixels either side of the rack's viewport within which rack shelves are given widgets
+    # they go back to being placeholders once they are twice as far away
+    rack_margin = 300
+    # rack shelf widgets kept after going out of view, to be reused when they come back into view
+    rack_pool_size = 10
 
     def __init__(self, model):
         super().__init__()
@@ -17,24 +39,58 @@ class Controller(QObject):
         self.edit_dict = {}
         self.edit_instances = []
 
+        # if saves append the changes since the last save to a journal kept next to the board
+        # instead of rewriting all of it each time
+        self.journaled_saves = False
+        # save or load running in the background, None if there isn't one
+        self.job = None
+        # file the board was last saved to or loaded from, which autosaves write to
+        self.board_path = None
+        # if changed boards are saved on their own
+        self.autosave = True
+        # model version at the last autosave check, when it was first seen, and at the last autosave
+        self.autosave_seen_version = self.model.version
+        self.autosave_seen_time = time.monotonic()
+        self.autosave_version = None
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.check_autosave)
+        self.autosave_timer.start(Controller.autosave_interval)
+        # rack shelves of a loaded board whose task widgets are still being built a slice at a time
+        self.building_shelves = []
+        # tasks to build for those shelves when the board was loaded, and how many are built so far
+        self.build_total = 0
+        self.build_done = 0
+        self.build_timer = QTimer(self)
+        self.build_timer.timeout.connect(self.build_next_slice)
+        # rack shelf widgets taken out of view by id, with the model version they were up to date with
+        self.rack_pool = {}
+        self.rack_timer = QTimer(self)
+        self.rack_timer.setSingleShot(True)
+        self.rack_timer.timeout.connect(self.update_rack)
+
         # connect model signals to view ui
         self.model.task_in_stage_changed.connect(self.change_task_in_stage)
         self.model.shelf_moved_in_task.connect(self.move_shelf_in_task)
         self.model.task_moved_in_shelf.connect(self.move_task_in_shelf)
+        self.model.shelf_reordered.connect(self.reorder_shelf)
+        self.model.contents_changed.connect(self.change_contents)
         self.model.shelf_added_to_rack.connect(self.add_shelf_to_rack)
         self.model.shelf_removed_from_rack.connect(self.remove_shelf_from_rack)
         self.model.shelf_moved_in_rack.connect(self.move_shelf_in_rack)
         self.model.shelf_info_changed.connect(self.change_shelf_info)
         self.model.task_info_changed.connect(self.change_task_info)
+        self.model.tasks_info_changed.connect(self.change_tasks_info)
         self.model.new_model_loaded.connect(self.load_new_model)
         self.model.field_about_to_add.connect(self.add_field)
         self.model.field_about_to_delete.connect(self.delete_field)
         self.model.field_about_to_rename.connect(self.rename_field)
+        self.model.rule_failed.connect(self.show_rule_error)
 
     def register_view(self, view):
         self.view = view
 
     # creates and returns widget with accompanying nested widgets already assembled into place
+    # nested widgets are only assembled below open trees, and the rest are built when their tree is opened
     def assemble_tree(self, df_id, is_id_task):
         # get children of this node from model
         if is_id_task:
@@ -44,15 +100,133 @@ class Controller(QObject):
             root = Shelf(self.view, None, df_id, **self.model.get_shelf_info([df_id])[df_id])
             children = self.model.get_subtasks(df_id)
 
-        # create the tree widgets from bottom to top
-        for c_id in children:
-            child = self.assemble_tree(c_id, not is_id_task)
-            root.add_child(child)
+        if not root.collapse_tree.state:
+            root.set_unbuilt(len(children))
+        else:
+            # create the tree widgets from bottom to top
+            self.build_children(root)
 
         return root
 
+    # number of children of the given shelf or task in the model
+    def count_children(self, df_id, is_id_task):
+        return len(self.model.get_subshelves(df_id) if is_id_task else self.model.get_subtasks(df_id))
+
+    # builds the child widgets of a tree that hasn't been opened before, keeping any already built
+    def build_children(self, widget):
+        is_task = isinstance(widget, Task)
+        children = self.model.get_subshelves(widget.df_id) if is_task else self.model.get_subtasks(widget.df_id)
+        # long shelves stay unbuilt, showing their tasks as painted rows, even once they have become shorter
+        if not is_task and (widget.task_list is not None or self.is_virtual(len(children))):
+            widget.set_virtual(ShelfTasks(self.model, widget.df_id))
+            widget.set_unbuilt(len(children))
+            return
+        widget.built = True
+        widget.set_children(self.matched_children(widget.get_children(), children, not is_task, set()))
+
+    # if a shelf with this many tasks shows them as painted rows
+    def is_virtual(self, task_count):
+        return Controller.virtual_shelf_tasks is not None and task_count >= Controller.virtual_shelf_tasks
+
+    # builds child widgets when a tree is opened, and counts down to tearing them down when it is collapsed
+    def tree_toggled(self, widget, opened):
+        if opened:
+            if widget.teardown_timer is not None:
+                widget.teardown_timer.stop()
+            if not widget.built:
+                self.build_children(widget)
+        elif widget.built and Controller.collapsed_teardown_seconds is not None:
+            if widget.teardown_timer is None:
+                widget.teardown_timer = QTimer(widget)
+                widget.teardown_timer.setSingleShot(True)
+                widget.teardown_timer.timeout.connect(self.tear_down_children)
+            widget.teardown_timer.start(int(1000 * Controller.collapsed_teardown_seconds))
+
+    # deletes the child widgets of a tree that has stayed collapsed, keeping only their count
+    @pyqtSlot()
+    def tear_down_children(self):
+        widget = self.sender().parent()
+        if widget.collapse_tree.state or not widget.built:
+            return
+        # wait for edits inside the tree to end before removing it
+        if self.is_editing_in(widget):
+            widget.teardown_timer.start()
+            return
+        children = widget.get_children()
+        widget.set_children([])
+        widget.set_unbuilt(len(children))
+        for c in children:
+            c.deleteLater()
+
+    # returns true if the widget being edited is the given widget or is nested in it
+    def is_editing_in(self, widget):
+        editing = self.widget_being_edited
+        while editing is not None and editing is not widget:
+            editing = editing.owner
+        return editing is widget
+
+    # update which rack columns have shelf widgets once the rack has settled
+    def schedule_rack_update(self):
+        self.rack_timer.start(0)
+
+    # gives shelf widgets to the rack columns inside or near the viewport and placeholders to the ones far from it
+    @pyqtSlot()
+    def update_rack(self):
+        if self.view is None:
+            return
+        rack = self.view.rack
+        near = rack.near_view(Controller.rack_margin)
+        kept = rack.near_view(2 * Controller.rack_margin)
+        for w in rack.get_children():
+            if isinstance(w, ShelfPlaceholder):
+                if w in near:
+                    rack.replace_child(w, self.rack_shelf(w.df_id))
+            elif w not in kept and not self.is_editing_in(w):
+                rack.replace_child(w, ShelfPlaceholder(w.df_id, w.width()))
+                self.pool_rack_shelf(w)
+        if len(self.building_shelves) != 0 and not self.build_timer.isActive():
+            self.build_timer.start(0)
+
+    # returns a widget for a rack shelf coming into view
+    # the widget it had before is reused if the board hasn't changed since, otherwise one is built a slice at a time
+    def rack_shelf(self, df_id):
+        widget, version = self.rack_pool.pop(df_id, (None, None))
+        if widget is not None:
+            if version == self.model.version:
+                return widget
+            widget.deleteLater()
+        widget = Shelf(self.view, None, df_id, **self.model.get_shelf_info([df_id])[df_id])
+        widget.set_unbuilt(self.count_children(df_id, False))
+        if self.is_virtual(widget.unbuilt_count):
+            self.build_children(widget)
+        else:
+            self.building_shelves.append(widget)
+        return widget
+
+    # keeps a rack shelf widget taken out of view, dropping the one kept longest once there are too many
+    def pool_rack_shelf(self, widget):
+        # shelves still being built are built again from the start when they come back
+        if widget in self.building_shelves:
+            widget.deleteLater()
+            return
+        if widget.df_id in self.rack_pool:
+            self.rack_pool.pop(widget.df_id)[0].deleteLater()
+        self.rack_pool[widget.df_id] = (widget, self.model.version)
+        while len(self.rack_pool) > Controller.rack_pool_size:
+            self.rack_pool.pop(next(iter(self.rack_pool)))[0].deleteLater()
+
     # returns all widget instances in the nesting tree of the given shelf or task
     def find_instances(self, df_id, is_id_task):
+        instances = self.view.get_instances(df_id, is_id_task)
+        if Controller.check_instances:
+            searched = self.search_instances(df_id, is_id_task)
+            if len(instances) != len(searched) or set(instances) != set(searched):
+                raise AssertionError("instances of " + df_id + " are out of date: " + str(len(instances)) +
+                                     " registered, " + str(len(searched)) + " found")
+        return instances
+
+    # returns all widget instances of the given shelf or task by searching up the nesting tree and back down
+    def search_instances(self, df_id, is_id_task):
         instances = []
         if is_id_task:
             # add stage appearance as an instance
@@ -64,17 +238,42 @@ class Controller(QObject):
             # add rack appearances as instances
             if df_id in self.model.rack:
                 indices = [i for i, x in enumerate(self.model.rack) if x == df_id]
-                instances.extend([self.view.rack.get_child(i) for i in indices])
+                instances.extend([w for w in [self.view.rack.get_child(i) for i in indices] if isinstance(w, Shelf)])
             # search up the tree and back down for instances of the parent
             parents = self.model.get_supertasks(df_id, include_index=True)
 
         # get instances from view and return
         for p in parents:
-            p_instances = self.find_instances(p[0], not is_id_task)
+            p_instances = self.search_instances(p[0], not is_id_task)
             for p_i in p_instances:
-                instances.append(p_i.get_child(p[1]-1))
+                # trees still being built may only have widgets for their first children
+                if p_i.built or p[1] <= len(p_i.get_children()):
+                    instances.append(p_i.get_child(p[1]-1))
+                # virtual shelves only have a task widget for their open row
+                elif isinstance(p_i, Shelf) and p_i.open_task() is not None and p_i.open_task().df_id == df_id:
+                    instances.append(p_i.open_task())
         return instances
 
+    # returns the instances of the given shelf or task with built child widgets
+    # and brings the child count of the rest up to date, which is all they show of their children
+    def built_instances(self, df_id, is_id_task):
+        instances = self.find_instances(df_id, is_id_task)
+        for inst in instances:
+            if not inst.built:
+                inst.set_unbuilt(len(self.match_built_children(inst)[0]))
+        return [inst for inst in instances if inst.built]
+
+    # brings the child widgets already built for a tree that is still being built in line with the model
+    # returns the ids of all its children and the widgets for the first of them
+    def match_built_children(self, widget):
+        is_task = isinstance(widget, Task)
+        children = self.model.get_subshelves(widget.df_id) if is_task else self.model.get_subtasks(widget.df_id)
+        current = widget.get_children()
+        if [c.df_id for c in current] != children[:len(current)]:
+            current = self.matched_children(current, children[:len(current)], not is_task, set())
+            widget.set_children(current)
+        return children, current
+
     # returns all widget instances in the nesting tree of the given shelf or task that have a value for the field
     def find_instances_by_field(self, field):
         # get task ids that have the field
@@ -92,8 +291,8 @@ class Controller(QObject):
         print(self.model.taskdf)
         print("_____SHELVES_____")
         print(self.model.shelfdf)
-        print("_____MATRIX_____")
-        print(self.model.nestmat)
+        print("_____NESTING_____")
+        print(self.model.nesting)
         print("_____RACK_____")
         print(self.model.rack)
         print("_____STAGE_____")
@@ -103,25 +302,29 @@ class Controller(QObject):
 
     @pyqtSlot()
     def new_shelf_in_rack(self):
-        df_id = self.model.create_empty_shelf()
-        self.model.add_shelf_to_rack(df_id)
+        with self.model.batch():
+            df_id = self.model.create_empty_shelf()
+            self.model.add_shelf_to_rack(df_id)
 
     @pyqtSlot()
     def new_task_in_stage(self):
-        df_id = self.model.create_empty_task()
-        self.model.replace_task_in_stage(df_id)
+        with self.model.batch():
+            df_id = self.model.create_empty_task()
+            self.model.replace_task_in_stage(df_id)
 
     @pyqtSlot(QWidget)
     def new_shelf_in_task(self, task):
-        shelf = self.model.create_empty_shelf()
-        success = self.model.position_shelf_in_task(shelf, task.df_id)
+        with self.model.batch():
+            shelf = self.model.create_empty_shelf()
+            success = self.model.position_shelf_in_task(shelf, task.df_id)
         if not success[0]:
             self.view.show_warning(success[1])
 
     @pyqtSlot(QWidget)
     def new_task_in_shelf(self, shelf):
-        task = self.model.create_empty_task()
-        success = self.model.position_task_in_shelf(task, shelf.df_id)
+        with self.model.batch():
+            task = self.model.create_empty_task()
+            success = self.model.position_task_in_shelf(task, shelf.df_id)
         if not success[0]:
             self.view.show_warning(success[1])
 
@@ -229,29 +432,95 @@ class Controller(QObject):
         else:
             self.model.replace_task_in_stage(line_edit.text())
 
+    # the board is read and built on another thread, and replaces the model once it is finished
+    # binary is chosen by the extension of the path unless given
     @pyqtSlot(str)
-    def load_tood(self, path):
-        if path != "":
-            with open(path, "r") as tood_file:
-                self.model.read_from_file(tood_file)
-
+    def load_tood(self, path, binary=None):
+        if path != "" and self.check_no_job():
+            if binary is None:
+                binary = is_binary_path(path)
+            job = LoadJob(path, binary)
+            job.loaded.connect(self.board_loaded)
+            self.start_job(job, True)
+
+    @pyqtSlot(object)
+    def board_loaded(self, board):
+        self.model.adopt(board)
+        self.board_path = self.job.path
+
+    # a snapshot of the board is written on another thread, so the model can still be edited while it is saved
+    # a journaled save only writes the whole board when its journal has grown too large to keep appending to
     @pyqtSlot(str)
-    def save_tood(self, path):
-        if path != "":
-            with open(path, "ab") as tood_file:
-                tood_file.seek(0)
-                tood_file.truncate()
-                self.model.write_to_file(tood_file)
+    def save_tood(self, path, binary=None, journaled=None):
+        if path != "" and self.check_no_job():
+            if binary is None:
+                binary = is_binary_path(path)
+            if journaled is None:
+                journaled = self.journaled_saves
+            self.board_path = path
+            if journaled and self.model.can_journal(path):
+                self.model.write_journal_entry(path)
+                return
+            job = SaveJob(self.model.snapshot_for_save(), path, binary, journaled)
+            job.saved.connect(self.model.snapshot_saved)
+            job.failed.connect(self.model.snapshot_not_saved)
+            job.cancelled.connect(self.model.snapshot_not_saved)
+            self.start_job(job, False)
+
+    # return true if no save or load is running, warning otherwise
+    def check_no_job(self):
+        if self.job is not None:
+            self.view.show_warning("wait for the current save or load to finish")
+            return False
+        return True
+
+    # run a save or load in the background, showing its progress
+    # modal progress keeps the board from being edited while it runs
+    def start_job(self, job, modal):
+        self.job = job
+        job.failed.connect(self.view.show_warning)
+        job.finished.connect(self.end_job)
+        self.view.show_progress(job, modal)
+        job.start()
+
+    @pyqtSlot()
+    def cancel_job(self):
+        if self.job is not None:
+            self.job.requestInterruption()
+
+    @pyqtSlot()
+    def end_job(self):
+        self.job.wait()
+        self.job = None
+        self.view.hide_progress()
+
+    # save the board to where it was last saved or loaded once it has gone unchanged for a while,
+    # or once it has had many changes since it was last saved
+    # a board is only autosaved once per version, so a failed autosave isn't retried until it changes again
+    @pyqtSlot()
+    def check_autosave(self):
+        version = self.model.version
+        if version != self.autosave_seen_version:
+            self.autosave_seen_version = version
+            self.autosave_seen_time = time.monotonic()
+        if (not self.autosave or self.board_path is None or self.job is not None
+                or self.model.changes_since_save() == 0 or version == self.autosave_version):
+            return
+        if (time.monotonic() - self.autosave_seen_time >= Controller.autosave_idle_seconds
+                or self.model.changes_since_save() >= Controller.autosave_change_limit):
+            self.autosave_version = version
+            self.save_tood(self.board_path)
 
     def duplicate_task_id(self, og_id):
         if og_id not in self.model.taskdf.index:
             self.view.show_warning(og_id+" is an invalid task ID")
             return
 
-        index = self.model.create_empty_task()
-        info_dict = self.model.get_task_info([og_id])[og_id]
-        info_dict.pop("seen")
-        success = self.model.edit_task(index, **info_dict)
+        with self.model.batch():
+            index = self.model.create_empty_task()
+            info_dict = self.model.get_task_info([og_id])[og_id]
+            info_dict.pop("seen")
+            success = self.model.edit_task(index, **info_dict)
         if not success[0]:
             self.view.show_warning(success[1])
         return index
@@ -290,10 +559,11 @@ class Controller(QObject):
             self.view.show_warning(og_id+" is an invalid shelf ID")
             return
 
-        index = self.model.create_empty_shelf()
-        info_dict = self.model.get_shelf_info([og_id])[og_id]
-        info_dict.pop("seen")
-        success = self.model.edit_shelf(index, **info_dict)
+        with self.model.batch():
+            index = self.model.create_empty_shelf()
+            info_dict = self.model.get_shelf_info([og_id])[og_id]
+            info_dict.pop("seen")
+            success = self.model.edit_shelf(index, **info_dict)
         if not success[0]:
             self.view.show_warning(success[1])
         return index
@@ -365,7 +635,12 @@ class Controller(QObject):
 
     @pyqtSlot(str, str, int, int)
     def move_shelf_in_task(self, shelf, task, start, end):
-        task_instances = self.find_instances(task, True)
+        task_instances = self.built_instances(task, True)
+        # move the widgets already there if the shelf stays in the task
+        if start != 0 and end != 0:
+            for t_i in task_instances:
+                t_i.move_child(t_i.get_child(start-1), end-1)
+            return
         # remove
         if start != 0:
             for t_i in task_instances:
@@ -378,7 +653,12 @@ class Controller(QObject):
 
     @pyqtSlot(str, str, int, int)
     def move_task_in_shelf(self, task, shelf, start, end):
-        shelf_instances = self.find_instances(shelf, False)
+        shelf_instances = self.built_instances(shelf, False)
+        # move the widgets already there if the task stays in the shelf
+        if start != 0 and end != 0:
+            for s_i in shelf_instances:
+                s_i.move_child(s_i.get_child(start-1), end-1)
+            return
         # remove
         if start != 0:
             for s_i in shelf_instances:
@@ -389,18 +669,31 @@ class Controller(QObject):
                 t_i = self.assemble_tree(task, True)
                 s_i.insert_child(t_i, end-1)
 
+    @pyqtSlot(str, list)
+    def reorder_shelf(self, shelf, order):
+        for s_i in self.built_instances(shelf, False):
+            s_i.reorder_children(order)
+
     @pyqtSlot(str, int)
     def add_shelf_to_rack(self, shelf, index):
         self.view.rack.insert_child(self.assemble_tree(shelf, False), index)
+        self.schedule_rack_update()
 
     @pyqtSlot(str, int)
     def remove_shelf_from_rack(self, shelf, index):
         self.view.rack.remove_child(self.view.rack.get_child(index))
+        self.schedule_rack_update()
 
     @pyqtSlot(str, int)
     def move_shelf_in_rack(self, shelf, index):
-        self.view.rack.remove_child(self.view.rack.get_child(index))
-        self.view.rack.insert_child(self.assemble_tree(shelf, False), index)
+        # the model moves the first appearance of the shelf in the rack
+        widget = next(w for w in self.view.rack.get_children() if w.df_id == shelf)
+        self.view.rack.move_child(widget, index)
+        self.schedule_rack_update()
+
+    @pyqtSlot(str, str)
+    def show_rule_error(self, shelf, error):
+        self.view.show_warning("Rules of " + shelf + " could not be run: " + error)
 
     @pyqtSlot(str, dict)
     def change_shelf_info(self, shelf, info):
@@ -413,9 +706,87 @@ class Controller(QObject):
         instances = self.find_instances(task, True)
         for inst in instances:
             inst.edit_fields(info)
+        # redraw the rows of virtual shelves holding the task
+        for s in self.model.get_supershelves(task):
+            for s_i in self.view.get_instances(s, False):
+                if s_i.task_list is not None:
+                    s_i.task_list.model().refresh_rows()
+
+    @pyqtSlot(dict)
+    def change_tasks_info(self, changes):
+        # walk the board once, updating every instance of an edited task as it is reached
+        to_visit = self.view.rack.get_shelves()
+        if self.model.stage is not None:
+            to_visit.append(self.view.stage.task)
+        while len(to_visit) != 0:
+            widget = to_visit.pop()
+            if isinstance(widget, Task) and widget.df_id in changes:
+                widget.edit_fields(changes[widget.df_id])
+            elif isinstance(widget, Shelf) and widget.task_list is not None:
+                widget.task_list.model().refresh_rows()
+                if widget.open_task() is not None:
+                    to_visit.append(widget.open_task())
+            to_visit.extend(widget.get_children())
+
+    @pyqtSlot(dict)
+    def change_contents(self, changes):
+        # widgets assembled here already match the model and don't need checking
+        fresh = set()
+        if changes["stage"]:
+            self.view.stage.clear()
+            if self.model.stage is not None:
+                widget = self.assemble_tree(self.model.stage, True)
+                self.view.stage.add_child(widget)
+                fresh.add(widget)
+        if changes["rack"]:
+            self.view.rack.set_children(self.matched_children(self.view.rack.get_children(), self.model.rack,
+                                                              False, fresh))
+            self.schedule_rack_update()
+
+        # walk the board from the top so each widget is brought up to date after the one holding it
+        shelves = set(changes["shelves"])
+        tasks = set(changes["tasks"])
+        to_visit = self.view.rack.get_shelves()
+        if self.model.stage is not None:
+            to_visit.append(self.view.stage.task)
+        while len(to_visit) != 0:
+            widget = to_visit.pop()
+            if widget in fresh:
+                continue
+            if not widget.built:
+                if widget.df_id in (tasks if isinstance(widget, Task) else shelves):
+                    widget.set_unbuilt(len(self.match_built_children(widget)[0]))
+            elif isinstance(widget, Task) and widget.df_id in tasks:
+                widget.set_children(self.matched_children(widget.get_children(),
+                                                          self.model.get_subshelves(widget.df_id), False, fresh))
+            elif isinstance(widget, Shelf) and widget.df_id in shelves:
+                widget.set_children(self.matched_children(widget.get_children(),
+                                                          self.model.get_subtasks(widget.df_id), True, fresh))
+            to_visit.extend(widget.get_children())
+            if isinstance(widget, Shelf) and widget.open_task() is not None:
+                to_visit.append(widget.open_task())
+
+    # widgets for a list of child ids, reusing current widgets with the same ids and assembling the rest
+    def matched_children(self, current, child_ids, are_children_tasks, fresh):
+        reusable = {}
+        for c in current:
+            reusable.setdefault(c.df_id, []).append(c)
+        children = []
+        for c_id in child_ids:
+            if len(reusable.get(c_id, [])) != 0:
+                children.append(reusable[c_id].pop(0))
+            else:
+                child = self.assemble_tree(c_id, are_children_tasks)
+                fresh.add(child)
+                children.append(child)
+        return children
 
     @pyqtSlot(dict, str, list)
     def load_new_model(self, fields, stage, rack):
+        # the loaded board counts its versions from its own, so versions seen before it say nothing about it
+        self.autosave_seen_version = self.model.version
+        self.autosave_seen_time = time.monotonic()
+        self.autosave_version = None
         # reload fields
         self.view.custom_fields.clear()
         for (k, v) in fields.items():
@@ -423,10 +794,57 @@ class Controller(QObject):
         # reload stage
         self.view.stage.clear()
         self.change_task_in_stage("", stage)
-        # reload rack
+        # reload rack with placeholders, then empty shelves for the ones in view
+        # whose tasks are built a slice at a time once the board is showing
         self.view.rack.clear()
-        for r in reversed(rack):
-            self.add_shelf_to_rack(r, 0)
+        self.building_shelves = []
+        for (widget, version) in self.rack_pool.values():
+            widget.deleteLater()
+        self.rack_pool = {}
+        for r in rack:
+            self.view.rack.add_child(ShelfPlaceholder(r, Rack.default_column_width))
+        self.view.rack.horizontalScrollBar().setValue(0)
+        self.update_rack()
+        self.build_total = sum(w.unbuilt_count for w in self.building_shelves)
+        self.build_done = 0
+        if self.view.build_progress is None:
+            self.view.show_build_progress()
+        self.build_timer.start(0)
+
+    # builds task widgets of the loaded rack until the time for this slice runs out, shelves in view first
+    @pyqtSlot()
+    def build_next_slice(self):
+        deadline = time.monotonic() + Controller.build_slice_seconds
+        while time.monotonic() < deadline:
+            # shelves may have been taken off the rack or opened and built since the last slice
+            self.building_shelves = [w for w in self.building_shelves if w.live and not w.built and w.task_list is None]
+            if len(self.building_shelves) == 0:
+                break
+            in_view = self.view.rack.near_view()
+            widget = next((w for w in self.building_shelves if w in in_view), self.building_shelves[0])
+            self.build_tasks_until(widget, deadline)
+
+        if len(self.building_shelves) == 0:
+            self.build_timer.stop()
+            if self.view.build_progress is not None:
+                self.view.hide_build_progress()
+        elif self.view.build_progress is not None:
+            self.view.update_build_progress(min(99, 100 * self.build_done // max(self.build_total, 1)))
+        # built shelves are wider, which can bring other columns into view
+        self.schedule_rack_update()
+
+    # builds the next task widgets of a rack shelf being built until the deadline
+    def build_tasks_until(self, widget, deadline):
+        children, current = self.match_built_children(widget)
+        more = []
+        for c_id in children[len(current):]:
+            more.append(self.assemble_tree(c_id, True))
+            if time.monotonic() >= deadline:
+                break
+        widget.extend_children(more)
+        self.build_done += len(more)
+        if len(current) + len(more) == len(children):
+            widget.built = True
 
     @pyqtSlot(str, str)
     def add_field(self, label, gadget):
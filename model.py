@@ -1,21 +1,224 @@
 from random import randint
+from contextlib import contextmanager
+import os
 import pandas as pd
-from PyQt5.QtCore import QObject, pyqtSignal
-import re
-import mmap
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from nesting import NestingStore
+from rules import Filter, Sorter, RuleError
+from tood import BoardSnapshot, read_tood, read_binary, is_binary_path, atomic_write, \
+    start_journal, append_journal, discard_journal, journal_size, read_journal
 
 pd.options.mode.chained_assignment = None
 
 
-# creates a new label index that doesn't overlap with any existing labels
-def generate_next_label(column_list, prefix=""):
-    if len(column_list) == 0:
-        # create first index of table
-        return prefix + str(randint(1, 25))
-    else:
-        # remove prefix and convert list of strings to ints
-        fixed_list = [int(x[len(prefix):]) for x in column_list]
-        return prefix + str(max(fixed_list) + randint(1, 25))
+class LabelAllocator:
+    # hands out new label indices that don't overlap with any existing or previously erased labels
+    # keeps the highest number used for each prefix so existing labels never need to be rescanned
+
+    def __init__(self):
+        # highest label number handed out so far, by prefix
+        self.high_water = {}
+
+    # set the mark for a prefix from a full list of existing labels
+    def rebuild(self, labels, prefix=""):
+        self.high_water[prefix] = max((int(x[len(prefix):]) for x in labels), default=0)
+
+    # creates a new label index
+    def next_label(self, prefix=""):
+        return self.next_labels(1, prefix=prefix)[0]
+
+    # creates count new label indices, leaving a random gap before each
+    def next_labels(self, count, prefix=""):
+        last = self.high_water.get(prefix, 0)
+        labels = []
+        for _ in range(count):
+            last += randint(1, 25)
+            labels.append(prefix + str(last))
+        self.high_water[prefix] = last
+        return labels
+
+
+class FrameJournal:
+    # what is needed to put a dataframe back the way it was, without copying all of it
+    # rows are copied the first time they are changed in place, and the whole frame only before its columns change
+    # rows added by replacing the frame need nothing kept, as they are dropped again
+
+    def __init__(self, df):
+        self.index = df.index
+        # copies of rows as they were, and the labels copied so far
+        self.rows = []
+        self.kept = set()
+        self.whole = None
+
+    # copy the rows about to be changed, the first time each of them is
+    def keep_rows(self, df, labels):
+        if self.whole is not None:
+            return
+        labels = [x for x in labels if x not in self.kept and x in self.index]
+        if len(labels) != 0:
+            self.kept.update(labels)
+            self.rows.append(df.loc[labels].copy())
+
+    # copy the frame before its columns change
+    def keep_whole(self, df):
+        if self.whole is None:
+            self.whole = df.copy()
+
+    # the frame as it was, made from the current one and what was kept
+    def restore(self, df):
+        base = self.whole if self.whole is not None else df
+        base = base.loc[base.index.isin(self.index) & ~base.index.isin(list(self.kept))]
+        if len(self.rows) != 0:
+            base = pd.concat([base] + self.rows)
+        return base.reindex(self.index)
+
+
+class PendingChanges:
+    # changes made to a model during a batch, held back until the batch finishes
+    # also keeps what is needed to put the model back the way it was if the batch fails
+
+    # signals that change the children of a shelf or task, and which argument holds that container
+    container_signals = {"task_moved_in_shelf": ("shelves", 1),
+                         "shelf_reordered": ("shelves", 0),
+                         "shelf_moved_in_task": ("tasks", 1)}
+    rack_signals = {"shelf_added_to_rack", "shelf_moved_in_rack", "shelf_removed_from_rack"}
+    # signals that can only be applied against the model as it was when they were sent
+    reload_signals = {"field_about_to_add", "field_about_to_delete", "field_about_to_rename", "new_model_loaded"}
+
+    def __init__(self, model):
+        # state from before the batch
+        self.task_frame = FrameJournal(model.taskdf)
+        self.shelf_frame = FrameJournal(model.shelfdf)
+        self.taskfields = dict(model.taskfields)
+        self.rack = list(model.rack)
+        self.stage = model.stage
+        self.labels = model.labels
+        self.high_water = dict(model.labels.high_water)
+        self.sort_ticket = model.sort_ticket
+        self.field_ops = len(model.unsaved.field_ops)
+        # nesting changes are journaled rather than copied
+        self.nesting = model.nesting
+        self.nesting.begin_journal()
+
+        # shelves and tasks whose children changed, and whether the rack or stage changed
+        self.shelves = set()
+        self.tasks = set()
+        self.rack_changed = False
+        self.stage_changed = False
+        # merged edits to each task and shelf
+        self.task_info = {}
+        self.shelf_info = {}
+        # true if the whole board has to be rebuilt
+        self.reload = False
+        # any other signals, in order and without repeats
+        self.other = []
+
+        # seen count changes to whole subtrees, summed by root and applied together once all changes are made
+        # the amounts are read from counts as they were before the batch, which applied over the nesting
+        # the batch leaves behind add up to the same counts as applying each change as it is made
+        self.task_seen = {}
+        self.shelf_seen = {}
+        # filter and sorter work to do once at the end
+        self.refilter = set()
+        self.resort = set()
+        self.rule_tasks = set()
+        self.rule_fields = set()
+        # true while the held work is being done
+        self.flushing = False
+
+    # record a signal instead of sending it
+    def hold(self, name, args):
+        if name in PendingChanges.container_signals:
+            kind, arg = PendingChanges.container_signals[name]
+            getattr(self, kind).add(args[arg])
+        elif name in PendingChanges.rack_signals:
+            self.rack_changed = True
+        elif name == "task_in_stage_changed":
+            self.stage_changed = True
+        elif name == "task_info_changed":
+            self.task_info.setdefault(args[0], {}).update(args[1])
+        elif name == "tasks_info_changed":
+            for (task, info) in args[0].items():
+                self.task_info.setdefault(task, {}).update(info)
+        elif name == "shelf_info_changed":
+            self.shelf_info.setdefault(args[0], {}).update(args[1])
+        elif name in PendingChanges.reload_signals:
+            self.reload = True
+        elif (name, args) not in self.other:
+            self.other.append((name, args))
+
+    # hold a seen count change to the trees below some shelves or tasks
+    def hold_seen(self, amounts, are_roots_tasks):
+        held = self.task_seen if are_roots_tasks else self.shelf_seen
+        for (root, amount) in amounts.items():
+            held[root] = held.get(root, 0) + amount
+
+    # send the smallest set of signals that brings the view up to date with the model
+    def send(self, model):
+        for (name, args) in self.other:
+            getattr(model, name).emit(*args)
+        if self.reload:
+            model.new_model_loaded.emit(model.taskfields, model.stage if model.stage is not None else "", model.rack)
+            return
+        # changes to erased shelves and tasks no longer matter
+        shelves = [s for s in self.shelves if s in model.shelfdf.index]
+        tasks = [t for t in self.tasks if t in model.taskdf.index]
+        if len(shelves) != 0 or len(tasks) != 0 or self.rack_changed or self.stage_changed:
+            model.contents_changed.emit({"shelves": shelves, "tasks": tasks,
+                                         "rack": self.rack_changed, "stage": self.stage_changed})
+        task_info = {t: i for (t, i) in self.task_info.items() if t in model.taskdf.index}
+        if len(task_info) != 0:
+            model.tasks_info_changed.emit(task_info)
+        for (shelf, info) in self.shelf_info.items():
+            if shelf in model.shelfdf.index:
+                model.shelf_info_changed.emit(shelf, info)
+
+
+class UnsavedChanges:
+    # what changed in a model since it was last saved, so a journaled save can write only that
+    # shelves and tasks are kept by id and written as they are when saved, or as erased if they are gone
+
+    def __init__(self):
+        # shelves and tasks that were created, edited, or erased
+        self.shelves = set()
+        self.tasks = set()
+        # field changes in the order they were made, each as an op for Model.apply_field_op
+        self.field_ops = []
+        self.rack = False
+        self.stage = False
+
+    def is_empty(self, nesting):
+        return (len(self.shelves) == 0 and len(self.tasks) == 0 and len(self.field_ops) == 0 and not self.rack
+                and not self.stage and len(nesting.changed) == 0)
+
+    # journal entry holding the current values of everything that changed
+    def entry(self, model):
+        shelves = [s for s in self.shelves if s in model.shelfdf.index]
+        tasks = [t for t in self.tasks if t in model.taskdf.index]
+        entry = {
+            "fields": model.taskfields,
+            "field_ops": self.field_ops,
+            "shelves": {**dict.fromkeys(self.shelves), **Model.plain_records(model.shelfdf.loc[shelves])},
+            "tasks": {**dict.fromkeys(self.tasks), **Model.plain_records(model.taskdf.loc[tasks])},
+            "shelf_tasks": {c: model.nesting.tasks_in(c) for c in model.nesting.changed
+                            if c in model.nesting.shelf_children},
+            "task_shelves": {c: model.nesting.shelves_in(c) for c in model.nesting.changed
+                             if c in model.nesting.task_children},
+            "labels": model.labels.high_water,
+        }
+        if self.rack:
+            entry["rack"] = model.rack
+        if self.stage:
+            entry["stage"] = model.stage
+        return entry
+
+    # add the changes made after these to them
+    def include(self, later):
+        self.shelves.update(later.shelves)
+        self.tasks.update(later.tasks)
+        self.field_ops.extend(later.field_ops)
+        self.rack = self.rack or later.rack
+        self.stage = self.stage or later.stage
 
 
 class Model(QObject):
@@ -28,12 +231,18 @@ class Model(QObject):
     shelf_removed_from_rack = pyqtSignal(str, int)  # shelf id, prev idx
     task_in_stage_changed = pyqtSignal(str, str)  # prev id, new id
     task_info_changed = pyqtSignal(str, dict)  # task id, all task values to be updated
+    tasks_info_changed = pyqtSignal(dict)  # task id to all task values to be updated, for many tasks at once
     shelf_info_changed = pyqtSignal(str, dict)  # shelf id, all shelf values to be updated
     new_model_loaded = pyqtSignal(dict, str, list)  # fields, stage, rack
+    tasks_created = pyqtSignal(list)  # task ids
+    shelf_reordered = pyqtSignal(str, list)  # shelf id, task ids in new order
+    shelves_created = pyqtSignal(list)  # shelf ids
+    contents_changed = pyqtSignal(dict)  # "shelves" and "tasks" whose children changed, and if "rack" or "stage" did
     field_about_to_add = pyqtSignal(str, str)  # label, field gadget
     field_about_to_delete = pyqtSignal(str)  # label
     field_data_copied = pyqtSignal(str, str)  # original label, copy label
     field_about_to_rename = pyqtSignal(str, str)  # old label, new label
+    rule_failed = pyqtSignal(str, str)  # shelf id, error message
 
     # conversion between field inputs and data types
     gadget_to_type = {
@@ -43,6 +252,23 @@ class Model(QObject):
         "date": pd.Timestamp
     }
 
+    # nullable dtype used to store each data type in a dataframe column
+    type_to_dtype = {
+        str: "string",
+        float: "Float64",
+        int: "Int32",
+        bool: "boolean",
+        pd.Timestamp: "datetime64[ns]"
+    }
+
+    # shelf columns that can't be missing, set to the empty value of their type instead
+    required_shelf_columns = ("is_filter", "filter_string", "is_sorter", "sorter_string")
+
+    # most entries a journal can hold before the next journaled save rewrites the whole board instead
+    journal_entry_limit = 100
+    # largest size of a journal, relative to the board it belongs to, before it is compacted the same way
+    journal_size_limit = 0.5
+
     def __init__(self):
         super(QObject, self).__init__()
 
@@ -61,17 +287,122 @@ class Model(QObject):
                              "sorter_string": str}
 
         # dataframe of task data by task index
-        self.taskdf = pd.DataFrame(columns=list(self.taskattributes) + list(self.taskfields))
+        self.taskdf = Model.typed_frame(pd.DataFrame(), self.task_dtypes())
         # dataframe of shelf data by shelf index
-        self.shelfdf = pd.DataFrame(columns=list(self.shelfattributes.keys()))
-        # nesting matrix of ordering of tasks within shelves and vice-versa; tasks are columns, shelves are rows
-        # positive integers are for task ordering in shelf, negative integers are for shelf ordering in task, 0 is none
+        self.shelfdf = Model.typed_frame(pd.DataFrame(), self.shelf_dtypes())
+        # ordering of tasks within shelves and vice-versa, stored sparsely as child lists and parent maps
         # no recursive loop is allowed to exist
-        self.nestmat = pd.DataFrame()
+        self.nesting = NestingStore()
         # the shelves displayed horizontally in the app
         self.rack = []
         #  spot for single task outside of shelves
         self.stage = None
+        # source of new task and shelf labels
+        self.labels = LabelAllocator()
+        # compiled filters by filter string
+        self.filters = {}
+        # compiled filter of each filter shelf
+        self.shelf_filters = {}
+        # filter shelves whose filter reads each task field
+        self.field_filters = {}
+        # parsed sorters by sorter string
+        self.sorters = {}
+        # sort key of each task in each sorter shelf, paired with a ticket that breaks ties by order of arrival
+        # the tasks of a sorter shelf are always in order of these keys
+        self.sort_keys = {}
+        # last tie-breaking ticket handed out
+        self.sort_ticket = 0
+        # changes held back during a batch, None outside of one
+        self.pending = None
+        # changes since the last save
+        self.unsaved = UnsavedChanges()
+        # board whose journal the next journaled save can append to, and the number of entries in it
+        self.journaled_path = None
+        self.journal_entries = 0
+        # changes from before the snapshot being saved, with the journal there was then, until the save is done
+        self.saving = None
+        # number of changes made to the model, and what it was when the model was last saved or loaded
+        self.version = 0
+        self.saved_version = 0
+
+    # send a signal, or hold it until the current batch finishes
+    # every signal other than a load is a change to the model
+    def notify(self, name, *args):
+        if name != "new_model_loaded":
+            self.version += 1
+        if self.pending is None:
+            getattr(self, name).emit(*args)
+        else:
+            self.pending.hold(name, args)
+
+    # group many changes so their signals, seen counts, and filter and sorter work are each handled once at the end
+    # if anything raises inside the batch, the model is put back the way it was and nothing is sent
+    # once the batch is done its changes are kept, even if a slot raises while they are being sent
+    # a batch started inside another batch joins the outer one
+    @contextmanager
+    def batch(self):
+        if self.pending is not None:
+            yield
+            return
+        self.pending = PendingChanges(self)
+        try:
+            yield
+            pending = self.finish_batch()
+        except BaseException:
+            self.rollback_batch()
+            raise
+        pending.send(self)
+
+    # true while filter and sorter work is being held for the end of a batch
+    def deferring_rules(self):
+        return self.pending is not None and not self.pending.flushing
+
+    # do the held work of the current batch and end it, returning its changes to be sent
+    def finish_batch(self):
+        pending = self.pending
+        # signals from this work are held too, so they are merged with the rest
+        pending.flushing = True
+        # seen counts are brought up to date first, for filters and sorters that read them
+        # roots erased during the batch hold nothing any more
+        self.increment_seen_trees({t: a for (t, a) in pending.task_seen.items()
+                                   if a != 0 and t in self.taskdf.index}, True)
+        self.increment_seen_trees({s: a for (s, a) in pending.shelf_seen.items()
+                                   if a != 0 and s in self.shelfdf.index}, False)
+        for shelf in pending.refilter:
+            if shelf in self.shelfdf.index and self.shelfdf.at[shelf, "is_filter"]:
+                self.refilter_shelf(shelf)
+        tasks = [t for t in pending.rule_tasks if t in self.taskdf.index]
+        if len(tasks) != 0:
+            self.rerun_rules(tasks, pending.rule_fields)
+        for shelf in pending.resort:
+            if shelf in self.shelfdf.index and self.shelfdf.at[shelf, "is_sorter"]:
+                self.resort_shelf(shelf)
+
+        self.pending = None
+        pending.nesting.end_journal()
+        return pending
+
+    # put the model back the way it was before the current batch, without sending anything
+    def rollback_batch(self):
+        pending = self.pending
+        self.pending = None
+        self.taskdf = pending.task_frame.restore(self.taskdf)
+        self.shelfdf = pending.shelf_frame.restore(self.shelfdf)
+        self.taskfields = pending.taskfields
+        self.rack = pending.rack
+        self.stage = pending.stage
+        self.labels = pending.labels
+        self.labels.high_water = pending.high_water
+        self.sort_ticket = pending.sort_ticket
+        self.nesting = pending.nesting
+        self.nesting.rollback_journal()
+        del self.unsaved.field_ops[pending.field_ops:]
+        # derived indices are rebuilt from the restored data
+        self.filters = {}
+        self.sorters = {}
+        self.sort_keys = {}
+        self.reindex_filters()
+        self.reindex_sorters()
 
     # returns true if the target shelf or task is found the current shelf or task in the nesting tree
     def check_tree_for(self, current, is_current_task, target, is_target_task, is_searching_up):
@@ -79,81 +410,122 @@ class Model(QObject):
         if is_current_task == is_target_task and current == target:
             return True
 
-        # find next tasks or shelves to check
-        if is_current_task:
-            strip = self.nestmat[current]
-            next_layer = strip.index[strip.values > 0 if is_searching_up else strip.values < 0]
-        else:
-            strip = self.nestmat.loc[current]
-            next_layer = strip.index[strip.values < 0 if is_searching_up else strip.values > 0]
-
-        # recursively check all children or parents
-        for x in next_layer:
-            if self.check_tree_for(x, not is_current_task, target, is_target_task, is_searching_up):
-                return True
-        return False
-
-    def run_on_tree(self, current, is_current_task, is_searching_up, function):
-        # run lambda expression
-        function(current=current, is_current_task=is_current_task)
-
-        # find next tasks or shelves to run on
-        if is_current_task:
-            strip = self.nestmat[current]
-            next_layer = strip.index[strip.values > 0 if is_searching_up else strip.values < 0]
-        else:
-            strip = self.nestmat.loc[current]
-            next_layer = strip.index[strip.values < 0 if is_searching_up else strip.values > 0]
-
-        # recursively run on all children or parents
-        for x in next_layer:
-            self.run_on_tree(x, not is_current_task, is_searching_up, function)
+        # answered by the reachability index rather than walking the tree
+        if is_searching_up:
+            return self.nesting.is_below(current, target)
+        return self.nesting.is_below(target, current)
 
+    # add to the seen count of a shelf or task and everything nested below it
+    # descendants reached along several linked paths are counted once per path, like their widget instances
     def increment_seen(self, current, is_current_task, amount):
-        if is_current_task:
-            self.taskdf.at[current, "seen"] += amount
-        else:
-            self.shelfdf.at[current, "seen"] += amount
+        self.increment_seen_trees({current: amount}, is_current_task)
+
+    # add to the seen counts of several shelves or tasks of the same kind and everything nested below them
+    # amounts is a dict of root id to the amount for its tree
+    def increment_seen_trees(self, amounts, are_roots_tasks):
+        if self.pending is not None and not self.pending.flushing:
+            self.pending.hold_seen(amounts, are_roots_tasks)
+            return
+        task_delta = {}
+        shelf_delta = {}
+        roots_delta = task_delta if are_roots_tasks else shelf_delta
+        for (current, amount) in amounts.items():
+            roots_delta[current] = roots_delta.get(current, 0) + amount
+            tasks, shelves = self.nesting.descendants_of(current)
+            for (t, paths) in tasks.items():
+                task_delta[t] = task_delta.get(t, 0) + paths * amount
+            for (s, paths) in shelves.items():
+                shelf_delta[s] = shelf_delta.get(s, 0) + paths * amount
+        task_delta = pd.Series(task_delta, index=list(task_delta), dtype=int)
+        shelf_delta = pd.Series(shelf_delta, index=list(shelf_delta), dtype=int)
+        # apply all changes to each dataframe at once
+        if len(task_delta) > 0:
+            self.keep_task_rows(task_delta.index)
+            self.taskdf.loc[task_delta.index, "seen"] += task_delta
+        if len(shelf_delta) > 0:
+            self.keep_shelf_rows(shelf_delta.index)
+            self.shelfdf.loc[shelf_delta.index, "seen"] += shelf_delta
+
+    # keep the rows of tasks or shelves as they were before the current batch, before they are changed in place
+    def keep_task_rows(self, labels):
+        if self.pending is not None:
+            self.pending.task_frame.keep_rows(self.taskdf, labels)
+
+    def keep_shelf_rows(self, labels):
+        if self.pending is not None:
+            self.pending.shelf_frame.keep_rows(self.shelfdf, labels)
+
+    # count the instances of every shelf and task again, starting from the rack and stage
+    def recount_seen(self):
+        self.keep_task_rows(self.taskdf.index)
+        self.keep_shelf_rows(self.shelfdf.index)
+        self.taskdf.loc[:, "seen"] = 0
+        self.shelfdf.loc[:, "seen"] = 0
+        in_rack = {}
+        for shelf in self.rack:
+            in_rack[shelf] = in_rack.get(shelf, 0) + 1
+        self.increment_seen_trees(in_rack, False)
+        if self.stage is not None:
+            self.increment_seen_trees({self.stage: 1}, True)
 
     # creates a new task index
     # return label of new task
     def create_empty_task(self):
-        label_idx = generate_next_label(list(self.taskdf.index.values), prefix="t")
-        self.taskdf.loc[label_idx] = {"label": "///",
-                                      "seen": 0,
-                                      "completed": False}
-        # add task to nesting matrix
-        self.nestmat[label_idx] = 0
-        return label_idx
+        return self.create_tasks(1)[0]
 
     # creates a new shelf index
     # return label of new shelf
     def create_empty_shelf(self):
-        label_idx = generate_next_label(list(self.shelfdf.index.values), prefix="s")
-        self.shelfdf.loc[label_idx] = {"title": "///",
-                                       "seen": 0,
-                                       "is_filter": False,
-                                       "filter_string": "",
-                                       "is_sorter": False,
-                                       "sorter_string": ""}
-        # add shelf to nesting matrix
-        if len(self.nestmat.columns) > 0:
-            self.nestmat.loc[label_idx] = 0
-        else:
-            self.nestmat = pd.concat([self.nestmat, pd.DataFrame(index=[label_idx])])
-        return label_idx
-
-    # change the position index of a task inside a shelf (positive ints in nest matrix)
+        return self.create_shelves(1)[0]
+
+    # creates n new task indices, adding all rows to the dataframe in one allocation
+    # return list of labels of new tasks
+    def create_tasks(self, n):
+        labels = self.labels.next_labels(n, prefix="t")
+        new_rows = Model.typed_frame(pd.DataFrame({"label": "///",
+                                                   "seen": 0,
+                                                   "completed": False}, index=labels), self.task_dtypes())
+        self.taskdf = new_rows if len(self.taskdf.index) == 0 else pd.concat([self.taskdf, new_rows])
+        self.unsaved.tasks.update(labels)
+        # add tasks to nesting
+        for label_idx in labels:
+            self.nesting.add_task(label_idx)
+        self.notify("tasks_created", labels)
+        return labels
+
+    # creates n new shelf indices, adding all rows to the dataframe in one allocation
+    # return list of labels of new shelves
+    def create_shelves(self, n):
+        labels = self.labels.next_labels(n, prefix="s")
+        new_rows = Model.typed_frame(pd.DataFrame({"title": "///",
+                                                   "seen": 0,
+                                                   "is_filter": False,
+                                                   "filter_string": "",
+                                                   "is_sorter": False,
+                                                   "sorter_string": ""}, index=labels), self.shelf_dtypes())
+        self.shelfdf = new_rows if len(self.shelfdf.index) == 0 else pd.concat([self.shelfdf, new_rows])
+        self.unsaved.shelves.update(labels)
+        # add shelves to nesting
+        for label_idx in labels:
+            self.nesting.add_shelf(label_idx)
+        self.notify("shelves_created", labels)
+        return labels
+
+    # change the position index of a task inside a shelf
     # adds task if index was previously zero and removes if index is now zero
     # return tuple: (success of program, termination message)
     def position_task_in_shelf(self, task, shelf, idx=None, filter_override=False, sorter_override=False):
-        prev_idx = self.nestmat.at[shelf, task]
-        tail_idx = max(self.nestmat.loc[shelf].max(), 0)
+        prev_idx = self.nesting.task_position(shelf, task)
+        tail_idx = self.nesting.count_tasks_in(shelf)
 
         # tasks can't be inserted at a specific position for a sorter, so idx must be None or 0 (for removal)
+        sort_key = None
         if self.shelfdf.at[shelf, "is_sorter"] and not sorter_override:
             if idx is None:
-                index = self.sort_task_into_shelf(task, shelf)
+                try:
+                    index, sort_key = self.sort_task_into_shelf(task, shelf)
+                except RuleError as e:
+                    return False, str(e)
             elif idx == 0:
                 index = idx
             else:
@@ -167,46 +539,44 @@ class Model(QObject):
             return False, "Invalid index given for insertion"
 
         # don't overwrite an opposite nest
-        if prev_idx < 0:
+        if self.nesting.shelf_position(task, shelf) != 0:
             return False, "Shelf is within task"
 
-        # if removing task, shift rightwards indices to the left
+        # if removing task, take its visibility away from the subtree
         if prev_idx != 0 and index == 0:
             # tasks cannot be removed from filters
             if self.shelfdf.at[shelf, "is_filter"] and not filter_override:
                 return False, "Can't remove task from filter shelf"
-            self.nestmat.loc[shelf, self.nestmat.loc[shelf] >= prev_idx] -= 1
-            self.run_on_tree(task, True, False, lambda **c:
-                             self.increment_seen(**c, amount=-self.shelfdf.at[shelf, "seen"]))
-        # if moving this task to the right, shift indices between the positions to the left
-        elif 0 < prev_idx < index:
-            self.nestmat.loc[shelf, (self.nestmat.loc[shelf] >= prev_idx) & (self.nestmat.loc[shelf] <= index)] -= 1
-        # if moving this task to the left, shift indices between the positions to the right
-        elif prev_idx > index:
-            self.nestmat.loc[shelf, (self.nestmat.loc[shelf] <= prev_idx) & (self.nestmat.loc[shelf] >= index)] += 1
-        # if adding new task, shift rightwards indices to the right
-        elif prev_idx == 0 and index != 0:
+            self.increment_seen(task, True, -self.shelfdf.at[shelf, "seen"])
+        # if moving this task, it can go no further than the last position
+        elif prev_idx != 0:
+            index = min(index, tail_idx)
+        # if adding new task, give its subtree the visibility of the shelf
+        elif index != 0:
             # tasks cannot be added to filters
             if self.shelfdf.at[shelf, "is_filter"] and not filter_override:
                 return False, "Can't add task to filter shelf"
-            # verify that shelf isn't below task and task isn't above shelf in nesting
-            if self.check_tree_for(task, True, shelf, False, False) or \
-                    self.check_tree_for(shelf, False, task, True, True):
+            # verify that shelf isn't below task in nesting
+            if self.check_tree_for(task, True, shelf, False, False):
                 return False, "Addition would create circular nesting"
-            self.nestmat.loc[shelf, self.nestmat.loc[shelf] >= index] += 1
-            self.run_on_tree(task, True, False, lambda **c:
-                             self.increment_seen(**c, amount=self.shelfdf.at[shelf, "seen"]))
-
-        self.nestmat.at[shelf, task] = index
-        self.task_moved_in_shelf.emit(task, shelf, prev_idx, index)
+            self.increment_seen(task, True, self.shelfdf.at[shelf, "seen"])
+
+        self.nesting.place_task(shelf, task, index)
+        # keep the sorted index of sorter shelves up to date
+        if shelf in self.sort_keys:
+            if index == 0:
+                self.sort_keys[shelf].pop(task, None)
+            elif sort_key is not None:
+                self.sort_keys[shelf][task] = sort_key
+        self.notify("task_moved_in_shelf", task, shelf, prev_idx, index)
         return True, ""
 
-    # change the position index of a shelf inside a task (negative ints in nest matrix)
+    # change the position index of a shelf inside a task
     # adds shelf if index was previously zero and removes if index is now zero
     # return tuple: (success of program, termination message)
     def position_shelf_in_task(self, shelf, task, idx=None):
-        tail_idx = max(-self.nestmat[task].min(), 0)
-        prev_idx = -self.nestmat.at[shelf, task]
+        tail_idx = self.nesting.count_shelves_in(task)
+        prev_idx = self.nesting.shelf_position(task, shelf)
         # by default, append to end
         index = tail_idx + 1 if idx is None else idx
 
@@ -215,35 +585,27 @@ class Model(QObject):
             return False, "Invalid index given for insertion"
 
         # don't overwrite an opposite nest
-        if prev_idx < 0:
+        if self.nesting.task_position(shelf, task) != 0:
             return False, "Task is within shelf"
 
-        # if removing shelf, shift rightwards indices to the left
+        # if removing shelf, take its visibility away from the subtree
         if prev_idx != 0 and index == 0:
-            self.nestmat[task][-self.nestmat[task] >= prev_idx] += 1
-            self.run_on_tree(shelf, False, False, lambda **c:
-                             self.increment_seen(**c, amount=-self.taskdf.at[task, "seen"]))
-        # if moving this shelf to the right, shift indices between the positions to the left
-        elif 0 < prev_idx < index:
-            self.nestmat[task][(-self.nestmat[task] >= prev_idx) & (-self.nestmat[task] <= index)] += 1
-        # if moving this shelf to the left, shift indices between the positions to the right
-        elif prev_idx > index:
-            self.nestmat[task][(-self.nestmat[task] <= prev_idx) & (-self.nestmat[task] >= index)] -= 1
-        # if adding new shelf, shift rightwards indices to the right
-        elif prev_idx == 0 and index != 0:
+            self.increment_seen(shelf, False, -self.taskdf.at[task, "seen"])
+        # if moving this shelf, it can go no further than the last position
+        elif prev_idx != 0:
+            index = min(index, tail_idx)
+        # if adding new shelf, give its subtree the visibility of the task
+        elif index != 0:
             # filters cannot be involved in nesting
             # if self.shelfdf.at[shelf, "is_filter"]:
             #     return False, "Can't add filter shelf to task"
-            # verify that task isn't below shelf and shelf isn't above task in nesting
-            if self.check_tree_for(shelf, False, task, True, False) or \
-                    self.check_tree_for(task, True, shelf, False, True):
+            # verify that task isn't below shelf in nesting
+            if self.check_tree_for(shelf, False, task, True, False):
                 return False, "Addition would create circular nesting"
-            self.nestmat[task][-self.nestmat[task] >= index] -= 1
-            self.run_on_tree(shelf, False, False, lambda **c:
-                             self.increment_seen(**c, amount=self.taskdf.at[task, "seen"]))
+            self.increment_seen(shelf, False, self.taskdf.at[task, "seen"])
 
-        self.nestmat.at[shelf, task] = -index
-        self.shelf_moved_in_task.emit(shelf, task, prev_idx, index)
+        self.nesting.place_shelf(task, shelf, index)
+        self.notify("shelf_moved_in_task", shelf, task, prev_idx, index)
         return True, ""
 
     # add a shelf to the rack
@@ -251,72 +613,149 @@ class Model(QObject):
         # add to end by default
         if insert_at is None:
             self.rack.append(shelf)
-            self.run_on_tree(shelf, False, False, lambda **c: self.increment_seen(**c, amount=1))
-            self.shelf_added_to_rack.emit(shelf, len(self.rack)-1)
+            self.unsaved.rack = True
+            self.increment_seen(shelf, False, 1)
+            self.notify("shelf_added_to_rack", shelf, len(self.rack)-1)
         else:
             self.rack.insert(insert_at, shelf)
-            self.run_on_tree(shelf, False, False, lambda **c: self.increment_seen(**c, amount=1))
-            self.shelf_added_to_rack.emit(shelf, insert_at)
+            self.unsaved.rack = True
+            self.increment_seen(shelf, False, 1)
+            self.notify("shelf_added_to_rack", shelf, insert_at)
 
     # move shelf to different position in rack
     def move_shelf_in_rack(self, shelf, index):
         self.rack.remove(shelf)
         self.rack.insert(index, shelf)
-        self.shelf_moved_in_rack.emit(shelf, index)
+        self.unsaved.rack = True
+        self.notify("shelf_moved_in_rack", shelf, index)
 
     # remove a shelf from the rack
     def remove_shelf_from_rack(self, index):
         shelf = self.rack.pop(index)
-        self.run_on_tree(shelf, False, False, lambda **c: self.increment_seen(**c, amount=-1))
-        self.shelf_removed_from_rack.emit(shelf, index)
+        self.unsaved.rack = True
+        self.increment_seen(shelf, False, -1)
+        self.notify("shelf_removed_from_rack", shelf, index)
 
     # change which task is in the stage
     def replace_task_in_stage(self, new_task):
         prev_task = self.stage
         self.stage = new_task
+        self.unsaved.stage = True
         if prev_task is not None:
-            self.run_on_tree(prev_task, True, False, lambda **c: self.increment_seen(**c, amount=-1))
+            self.increment_seen(prev_task, True, -1)
         if new_task is not None:
-            self.run_on_tree(new_task, True, False, lambda **c: self.increment_seen(**c, amount=1))
-        self.task_in_stage_changed.emit(prev_task if prev_task is not None else None,
-                                        new_task if new_task is not None else None)
+            self.increment_seen(new_task, True, 1)
+        self.notify("task_in_stage_changed", prev_task if prev_task is not None else None,
+                    new_task if new_task is not None else None)
 
     # edit task data via dict and check against relevant columns
     # return tuple: (success of program, termination message)
     def edit_task(self, task, **kwargs):
 
         # make sure all values are of the correct type
-        for key in kwargs:
-            if key not in self.taskattributes and key not in self.taskfields:
-                return False, key + " is not a task parameter"
-            if kwargs[key] is not None and key in self.taskattributes and not isinstance(kwargs[key],
-                                                                                         self.taskattributes.get(key)):
-                # convert types that need conversion
-                if self.taskattributes.get(key) == pd.Timestamp:
-                    kwargs[key] = pd.Timestamp(kwargs[key])
-                else:
-                    return False, key + " must have type " + self.taskattributes[key].__name__
-            if kwargs[key] is not None and key in self.taskfields \
-                    and not isinstance(kwargs[key], Model.gadget_to_type.get(self.taskfields[key])):
-                # convert types that need conversion
-                if Model.gadget_to_type.get(self.taskfields[key]) == pd.Timestamp:
-                    kwargs[key] = pd.Timestamp(kwargs[key])
-                else:
-                    return False, key + " must have type " + Model.gadget_to_type.get(self.taskfields[key]).__name__
-
-        # don't allow internal parameters to be modified
-        if "seen" in kwargs:
-            return False, "seen is an internal parameter"
+        success, message = self.check_task_values(kwargs.keys(), [kwargs])
+        if not success:
+            return False, message
 
         # update values
+        self.keep_task_rows([task])
         self.taskdf.loc[task, kwargs.keys()] = kwargs.values()
-        self.task_info_changed.emit(task, kwargs)
+        self.unsaved.tasks.add(task)
+        self.notify("task_info_changed", task, kwargs)
+
+        if self.deferring_rules():
+            self.rerun_rules([task], kwargs.keys())
+            return True, ""
+        # check if task needs to be added/removed from filters that read the edited fields
+        self.check_against_filters(task, kwargs.keys())
+        # check if task needs to be resorted in any sorters it is in that read the edited fields
+        self.check_parent_sorters(task, kwargs.keys())
+
+        return True, ""
+
+    # edit many tasks at once via dict of task id to dict of values
+    # values are written one column at a time, filters and sorters are rerun once for all affected tasks,
+    # and a single signal is emitted with every change
+    # return tuple: (success of program, termination message)
+    def edit_tasks(self, edits):
+        for task in edits:
+            if task not in self.taskdf.index:
+                return False, str(task) + " is not a task"
 
-        # check if task needs to be added/removed from filters
-        self.check_against_filters(task)
-        # check if task needs to be resorted in any sorters it is in
-        self.check_parent_sorters(task)
+        # make sure all values are of the correct type
+        fields = set().union(*[e.keys() for e in edits.values()])
+        success, message = self.check_task_values(fields, edits.values())
+        if not success:
+            return False, message
+
+        # update values, one assignment per column
+        self.keep_task_rows(edits)
+        for field in fields:
+            column = {t: e[field] for (t, e) in edits.items() if field in e}
+            self.taskdf.loc[list(column), field] = list(column.values())
+        self.unsaved.tasks.update(edits)
+        self.notify("tasks_info_changed", edits)
+
+        self.rerun_rules(list(edits), fields)
+        return True, ""
 
+    # rerun filters and sorters that read any of the fields for the given tasks, each filter and sorter once
+    # held until the end if there is a batch
+    def rerun_rules(self, tasks, fields):
+        if self.deferring_rules():
+            self.pending.rule_tasks.update(tasks)
+            self.pending.rule_fields.update(fields)
+            return
+
+        # rerun filters that read the edited fields on the edited tasks only
+        affected = set().union(*[self.field_filters.get(f, ()) for f in fields])
+        for shelf in [s for s in self.shelf_filters if s in affected]:
+            try:
+                mask = self.shelf_filters[shelf].mask(self.taskdf.loc[tasks])
+            except RuleError as e:
+                self.report_rule_error(shelf, e)
+                continue
+            in_shelf = [self.nesting.task_position(shelf, t) != 0 for t in tasks]
+            to_add = [t for (t, m, i) in zip(tasks, mask, in_shelf) if m and not i]
+            to_remove = [t for (t, m, i) in zip(tasks, mask, in_shelf) if i and not m]
+            if len(to_add) != 0 or len(to_remove) != 0:
+                self.update_shelf_members(shelf, to_add, to_remove)
+
+        # resort each sorter holding an edited task once, if it reads the edited fields
+        sorter_ids = set().union(*[self.nesting.shelves_holding(t) for t in tasks])
+        for shelf in sorter_ids:
+            if not self.shelfdf.at[shelf, "is_sorter"]:
+                continue
+            try:
+                if self.compiled_sorter(self.shelfdf.at[shelf, "sorter_string"]).fields.isdisjoint(fields):
+                    continue
+            except RuleError as e:
+                self.report_rule_error(shelf, e)
+                continue
+            self.resort_shelf(shelf)
+
+    # make sure the given fields exist and every dict of values has the right types for them
+    # values that need conversion are converted in place
+    # return tuple: (success of program, termination message)
+    def check_task_values(self, fields, value_dicts):
+        types = {}
+        for key in fields:
+            if key not in self.taskattributes and key not in self.taskfields:
+                return False, key + " is not a task parameter"
+            # don't allow internal parameters to be modified
+            if key == "seen":
+                return False, "seen is an internal parameter"
+            types[key] = self.taskattributes[key] if key in self.taskattributes \
+                else Model.gadget_to_type.get(self.taskfields[key])
+
+        for values in value_dicts:
+            for key in values:
+                if values[key] is not None and not isinstance(values[key], types[key]):
+                    # convert types that need conversion
+                    if types[key] == pd.Timestamp:
+                        values[key] = pd.Timestamp(values[key])
+                    else:
+                        return False, key + " must have type " + types[key].__name__
         return True, ""
 
     # edit shelf data via dict and verify tasks if necessary
@@ -326,6 +765,8 @@ class Model(QObject):
         for key in kwargs:
             if key not in self.shelfattributes:
                 return False, key + " is not a shelf parameter"
+            if kwargs[key] is None and key in Model.required_shelf_columns:
+                kwargs[key] = self.shelfattributes[key]()
             if kwargs[key] is not None and not isinstance(kwargs[key], self.shelfattributes.get(key)):
                 # convert types that need conversion
                 if self.shelfattributes.get(key) == pd.Timestamp:
@@ -335,18 +776,41 @@ class Model(QObject):
 
         # don't create filters that are subshelves of any task
         # if "is_filter" in kwargs and kwargs["is_filter"]:
-        #     strip = self.nestmat.loc[shelf]
-        #     next_layer = strip.index[strip.values < 0]
-        #     if len(next_layer) != 0:
+        #     if len(self.get_supertasks(shelf)) != 0:
         #         return False, "Subshelves can't become filters"
 
         # don't allow internal parameters to be modified
         if "seen" in kwargs:
             return False, "seen is an internal parameter"
 
+        # make sure the filter and sorter can be understood, and can be run on the tasks they will be given
+        try:
+            if kwargs.get("filter_string") is not None:
+                compiled = self.compiled_filter(kwargs["filter_string"])
+                if kwargs.get("is_filter", self.shelfdf.at[shelf, "is_filter"]):
+                    compiled.mask(self.taskdf)
+            if kwargs.get("sorter_string") is not None:
+                compiled = self.compiled_sorter(kwargs["sorter_string"])
+                if kwargs.get("is_sorter", self.shelfdf.at[shelf, "is_sorter"]):
+                    compiled.order(self.taskdf, self.get_subtasks(shelf))
+        except RuleError as e:
+            return False, str(e)
+
         # update values
+        self.keep_shelf_rows([shelf])
         self.shelfdf.loc[shelf, kwargs.keys()] = kwargs.values()
-        self.shelf_info_changed.emit(shelf, kwargs)
+        self.unsaved.shelves.add(shelf)
+        self.notify("shelf_info_changed", shelf, kwargs)
+        if "is_filter" in kwargs or "filter_string" in kwargs:
+            self.index_filter(shelf)
+        if not self.shelfdf.at[shelf, "is_sorter"]:
+            self.sort_keys.pop(shelf, None)
+
+        # redo filtering and sorting once at the end of a batch
+        if self.deferring_rules():
+            self.pending.refilter.add(shelf)
+            self.pending.resort.add(shelf)
+            return True, ""
 
         # redo filtering
         if self.shelfdf.at[shelf, "is_filter"]:
@@ -359,37 +823,50 @@ class Model(QObject):
 
     # delete all data associated with task
     def erase_task(self, task):
-        # remove from task listing
-        self.taskdf.drop(index=task, inplace=True)
+        with self.batch():
+            # remove from all supershelves
+            for shelf in self.get_supershelves(task):
+                self.position_task_in_shelf(task, shelf, idx=0, filter_override=True, sorter_override=True)
+
+            # remove from stage
+            if task == self.stage:
+                self.replace_task_in_stage(None)
 
-        # remove from all supershelves
-        strip = self.nestmat[task]
-        for shelf in strip.index[strip.values > 0]:
-            self.position_task_in_shelf(task, shelf, idx=0, filter_override=True, sorter_override=True)
+            # take its visibility away from the shelves inside it
+            for shelf in self.get_subshelves(task):
+                self.position_shelf_in_task(shelf, task, idx=0)
 
-        # remove from stage
-        if task == self.stage:
-            self.replace_task_in_stage(None)
+            # delete from nesting
+            self.nesting.remove_task(task)
 
-        # delete from nesting list
-        self.nestmat.drop(columns=task, inplace=True)
+            # remove from task listing
+            self.keep_task_rows([task])
+            self.taskdf.drop(index=task, inplace=True)
+            self.unsaved.tasks.add(task)
 
     # delete all data associated with shelf
     def erase_shelf(self, shelf):
-        # remove from shelf listing
-        self.shelfdf.drop(index=shelf, inplace=True)
+        with self.batch():
+            # remove every appearance from rack
+            for index in reversed([i for (i, s) in enumerate(self.rack) if s == shelf]):
+                self.remove_shelf_from_rack(index)
 
-        # remove from rack
-        if shelf in self.rack:
-            self.rack.remove(shelf)
+            # remove from all supertasks
+            for task in self.get_supertasks(shelf):
+                self.position_shelf_in_task(shelf, task, idx=0)
 
-        # remove from all supertasks
-        strip = self.nestmat.loc[shelf]
-        for task in strip.index[strip.values < 0]:
-            self.position_shelf_in_task(shelf, task, idx=0)
+            # take its visibility away from the tasks inside it
+            self.update_shelf_members(shelf, [], self.get_subtasks(shelf))
 
-        # delete from nesting list
-        self.nestmat.drop(index=shelf, inplace=True)
+            # delete from nesting, filters, and sorters
+            self.nesting.remove_shelf(shelf)
+            self.unindex_filter(shelf)
+            self.sort_keys.pop(shelf, None)
+
+            # remove from shelf listing
+            self.keep_shelf_rows([shelf])
+            self.shelfdf.drop(index=shelf, inplace=True)
+            self.unsaved.shelves.add(shelf)
 
     # add a new field for tasks
     def add_custom_field(self, label, gadget):
@@ -400,10 +877,13 @@ class Model(QObject):
         if not label.isidentifier():
             return False, label + " is not a valid identifier"
 
-        self.field_about_to_add.emit(label, gadget)
+        self.notify("field_about_to_add", label, gadget)
 
-        self.taskfields[label] = gadget
-        self.taskdf[label] = None
+        self.change_fields(("add", label, gadget))
+        self.filters = {}
+        self.sorters = {}
+        self.reindex_filters()
+        self.reindex_sorters()
 
         return True, ""
 
@@ -412,10 +892,13 @@ class Model(QObject):
         if label not in self.taskfields.keys():
             return False, label + " isn't an existing field"
 
-        self.field_about_to_delete.emit(label)
+        self.notify("field_about_to_delete", label)
 
-        self.taskfields.pop(label)
-        self.taskdf.drop(columns=label, inplace=True)
+        self.change_fields(("delete", label))
+        self.filters = {}
+        self.sorters = {}
+        self.reindex_filters()
+        self.reindex_sorters()
 
         return True, ""
 
@@ -426,9 +909,9 @@ class Model(QObject):
         if to_l not in self.taskfields.keys():
             return False, to_l + " isn't an existing field"
 
-        self.taskdf[to_l] = self.taskdf[from_l]
+        self.change_fields(("copy", from_l, to_l))
 
-        self.field_data_copied.emit(from_l, to_l)
+        self.notify("field_data_copied", from_l, to_l)
         return True, ""
 
     # change the label for a field
@@ -444,246 +927,547 @@ class Model(QObject):
         if not new_l.isidentifier():
             return False, new_l + " is not a valid identifier"
 
-        self.field_about_to_rename.emit(old_l, new_l)
-
-        self.taskfields[new_l] = self.taskfields.pop(old_l)
-        self.taskdf.rename(columns={old_l: new_l}, inplace=True)
+        self.notify("field_about_to_rename", old_l, new_l)
 
+        self.change_fields(("rename", old_l, new_l))
+        self.filters = {}
+        self.sorters = {}
+        self.reindex_filters()
+        self.reindex_sorters()
 
         return True, ""
 
-    # sorter and filter methods should be rewritten to use pandas functionality
+    # apply a change to the task fields and their columns, keeping it for the next journaled save
+    def change_fields(self, op):
+        self.apply_field_op(op)
+        self.unsaved.field_ops.append(op)
+
+    # ("add", label, gadget), ("delete", label), ("copy", from label, to label) or ("rename", old label, new label)
+    def apply_field_op(self, op):
+        if self.pending is not None:
+            self.pending.task_frame.keep_whole(self.taskdf)
+        if op[0] == "add":
+            self.taskfields[op[1]] = op[2]
+            self.taskdf[op[1]] = pd.Series(pd.NA, index=self.taskdf.index,
+                                           dtype=Model.type_to_dtype[Model.gadget_to_type[op[2]]])
+        elif op[0] == "delete":
+            self.taskfields.pop(op[1])
+            self.taskdf.drop(columns=op[1], inplace=True)
+        elif op[0] == "copy":
+            self.taskdf[op[2]] = Model.typed_series(self.taskdf[op[1]], self.task_dtypes()[op[2]])
+        elif op[0] == "rename":
+            self.taskfields[op[2]] = self.taskfields.pop(op[1])
+            self.taskdf.rename(columns={op[1]: op[2]}, inplace=True)
+
+    # return dict of every task column to the type its values should have
+    def task_types(self):
+        types = dict(self.taskattributes)
+        types.update({k: Model.gadget_to_type[v] for (k, v) in self.taskfields.items()})
+        return types
+
+    # return dict of the task columns filters and sorters can read to their types
+    # seen counts change with nesting rather than with edits to tasks, which is what reruns rules, so they are left out
+    def rule_types(self):
+        types = self.task_types()
+        types.pop("seen")
+        return types
+
+    # return the compiled form of a filter string, compiling it the first time it is used
+    def compiled_filter(self, filter_string):
+        if filter_string not in self.filters:
+            self.filters[filter_string] = Filter(filter_string, self.rule_types())
+        return self.filters[filter_string]
+
+    # compile the filter of a shelf and record which fields it reads
+    def index_filter(self, shelf):
+        self.unindex_filter(shelf)
+        if not self.shelfdf.at[shelf, "is_filter"]:
+            return
+        # filters that can't be understood are left as they are
+        try:
+            compiled = self.compiled_filter(self.shelfdf.at[shelf, "filter_string"])
+        except RuleError:
+            return
+        self.shelf_filters[shelf] = compiled
+        for field in compiled.fields:
+            self.field_filters.setdefault(field, set()).add(shelf)
+
+    # stop tracking the filter of a shelf
+    def unindex_filter(self, shelf):
+        compiled = self.shelf_filters.pop(shelf, None)
+        if compiled is not None:
+            for field in compiled.fields:
+                self.field_filters[field].discard(shelf)
+
+    # rebuild filter tracking for every shelf
+    def reindex_filters(self):
+        self.shelf_filters = {}
+        self.field_filters = {}
+        for shelf in self.shelfdf.index:
+            self.index_filter(shelf)
 
     # apply filter to task, return boolean for if the task passes
     def run_filter_on(self, task, filter_string):
-        return not self.taskdf.loc[task].completed
+        return self.compiled_filter(filter_string).passes(self.taskdf, task)
 
     # add task to any filters in which it should belong and remove from any it shouldn't
-    def check_against_filters(self, task):
-        filters = self.shelfdf.loc[self.shelfdf["is_filter"]]
-        filter_strings = filters["filter_string"]
-        filter_ids = filters.index
-        for string, dfid in zip(filter_strings, filter_ids):
-            if self.run_filter_on(task, string):
-                if self.nestmat.at[id, task] == 0:
+    # when fields are given, only filters that read one of them are checked
+    def check_against_filters(self, task, fields=None):
+        if fields is None:
+            filter_ids = list(self.shelf_filters)
+        else:
+            affected = set().union(*[self.field_filters.get(f, ()) for f in fields])
+            filter_ids = [s for s in self.shelf_filters if s in affected]
+        for dfid in filter_ids:
+            try:
+                passes = self.shelf_filters[dfid].passes(self.taskdf, task)
+            except RuleError as e:
+                self.report_rule_error(dfid, e)
+                continue
+            if passes:
+                if self.nesting.task_position(dfid, task) == 0:
                     self.position_task_in_shelf(task, dfid, filter_override=True)
             else:
-                if self.nestmat.at[id, task] != 0:
+                if self.nesting.task_position(dfid, task) != 0:
                     self.position_task_in_shelf(task, dfid, idx=0, filter_override=True)
 
+    # tell the user the filter or sorter of a shelf couldn't be run, which leaves its tasks as they were
+    # this isn't a change to the model, so it is sent straight away, even during a batch
+    def report_rule_error(self, shelf, error):
+        self.rule_failed.emit(shelf, str(error))
+
     # check all tasks against this filter and add or remove ones when necessary
     def refilter_shelf(self, shelf):
-        f_string = self.shelfdf.at[shelf, "filter_string"]
-        for task in self.taskdf.index:
-            if self.run_filter_on(task, f_string):
-                if self.nestmat.at[shelf, task] == 0:
-                    self.position_task_in_shelf(task, shelf, filter_override=True)
-            else:
-                if self.nestmat.at[shelf, task] != 0:
-                    self.position_task_in_shelf(task, shelf, idx=0, filter_override=True)
+        if shelf not in self.shelf_filters:
+            return
+        try:
+            mask = self.shelf_filters[shelf].mask(self.taskdf)
+        except RuleError as e:
+            self.report_rule_error(shelf, e)
+            return
+        passing = self.taskdf.index[mask]
+        current = self.get_subtasks(shelf)
+        in_shelf = set(current)
+        passing_set = set(passing)
+        to_remove = [t for t in current if t not in passing_set]
+        to_add = [t for t in passing if t not in in_shelf]
+        self.update_shelf_members(shelf, to_add, to_remove)
+
+    # remove and then append many tasks in a shelf at once, ignoring filter and sorter rules
+    # tasks that would create circular nesting are not added
+    def update_shelf_members(self, shelf, to_add, to_remove):
+        to_add = [t for t in to_add if self.nesting.shelf_position(t, shelf) == 0 and
+                  not self.check_tree_for(t, True, shelf, False, False)]
+
+        # update visibility of every affected subtree together
+        shelf_seen = self.shelfdf.at[shelf, "seen"]
+        amounts = {t: -shelf_seen for t in to_remove}
+        amounts.update({t: shelf_seen for t in to_add})
+        self.increment_seen_trees(amounts, True)
+
+        # signal removals from the back so each index is still correct when it is applied
+        positions = self.nesting.remove_tasks(shelf, to_remove)
+        for task in sorted(positions, key=positions.get, reverse=True):
+            self.notify("task_moved_in_shelf", task, shelf, positions[task], 0)
+        tail_idx = self.nesting.count_tasks_in(shelf)
+        self.nesting.append_tasks(shelf, to_add)
+        for (i, task) in enumerate(to_add):
+            self.notify("task_moved_in_shelf", task, shelf, 0, tail_idx + i + 1)
+
+        # appended tasks need to be put in place in sorters
+        if self.deferring_rules():
+            self.pending.resort.add(shelf)
+        elif self.shelfdf.at[shelf, "is_sorter"]:
+            self.resort_shelf(shelf)
+        else:
+            self.sort_keys.pop(shelf, None)
 
-    # apply sorter to task, return its resulting integer weight
+    # return the parsed form of a sorter string, parsing it the first time it is used
+    def compiled_sorter(self, sorter_string):
+        if sorter_string not in self.sorters:
+            self.sorters[sorter_string] = Sorter(sorter_string, self.rule_types())
+        return self.sorters[sorter_string]
+
+    # apply sorter to task, return its tuple of sort keys
     def run_sorter_on(self, task, sorter_string):
-        return self.taskdf.at[task, "value"]
+        return tuple(self.compiled_sorter(sorter_string).key_frame(self.taskdf, [task]).iloc[0])
 
     # check that the task is in the correct position in all of its sorters, and fix the position if it isn't
-    def check_parent_sorters(self, task):
-        strip = self.nestmat[task]
-        shelves = strip.index[strip.values > 0]
-        sorters = self.shelfdf.loc[shelves].loc[self.shelfdf["is_sorter"]]
-        sorter_ids = sorters.index
+    # when fields are given, only sorters that read one of them are checked
+    def check_parent_sorters(self, task, fields=None):
+        shelves = self.shelfdf.loc[self.get_supershelves(task)]
+        sorter_ids = shelves.index[shelves["is_sorter"].astype(bool)]
         for dfid in sorter_ids:
-            index = self.sort_task_into_shelf(task, dfid)
-            if index != self.nestmat.at[dfid, task]:
+            try:
+                sorter = self.compiled_sorter(self.shelfdf.at[dfid, "sorter_string"])
+                if fields is not None and sorter.fields.isdisjoint(fields):
+                    continue
+                index, sort_key = self.sort_task_into_shelf(task, dfid)
+            except RuleError as e:
+                self.report_rule_error(dfid, e)
+                continue
+            if index != self.nesting.task_position(dfid, task):
                 self.position_task_in_shelf(task, dfid, idx=index, sorter_override=True)
+            self.sort_keys[dfid][task] = sort_key
 
-    # fix positions of tasks in shelf to match  the
+    # fix positions of all tasks in shelf to match its sorter in one reordering, and rebuild its sorted index
     def resort_shelf(self, shelf):
-        s_string = self.shelfdf.at[shelf, "sorter_string"]
-        strip = self.nestmat.loc[shelf]
-        curr_order = strip[strip.values > 0]
-        new_order = pd.Series([self.run_sorter_on(x, s_string) for x in curr_order.keys()], curr_order.keys())
-        new_order = new_order.sort_values(ascending=False)
-        for i, task in enumerate(reversed(new_order.keys())):
-            self.position_task_in_shelf(task, shelf, idx=len(new_order)-i, sorter_override=True)
-
-    # given that a shelf is sorted, find the index that the task should be inserted to preserve decreasing order
+        try:
+            sorter = self.compiled_sorter(self.shelfdf.at[shelf, "sorter_string"])
+            curr_order = self.get_subtasks(shelf)
+            new_order = sorter.order(self.taskdf, curr_order)
+            keys = sorter.comparable_keys(self.taskdf, new_order)
+        except RuleError as e:
+            self.sort_keys.pop(shelf, None)
+            self.report_rule_error(shelf, e)
+            return
+        # tickets follow the new order so ties stay where they are
+        self.sort_keys[shelf] = {t: (k, self.sort_ticket + i + 1) for (i, (t, k)) in enumerate(zip(new_order, keys))}
+        self.sort_ticket += len(new_order)
+        if new_order != curr_order:
+            self.nesting.reorder_tasks(shelf, new_order)
+            self.notify("shelf_reordered", shelf, new_order)
+
+    # resort every sorter shelf, rebuilding their sorted indices
+    def reindex_sorters(self):
+        for shelf in self.shelfdf.index[self.shelfdf["is_sorter"].astype(bool)]:
+            self.resort_shelf(shelf)
+
+    # given that a shelf is sorted, find the index the task should have to preserve the order
+    # uses the sorted index of the shelf, so only the key of this task is computed
+    # return tuple: (index, sort key to store for the task)
     def sort_task_into_shelf(self, task, shelf):
-        s_string = self.shelfdf.at[shelf, "sorter_string"]
-        strip = self.nestmat.loc[shelf]
-        curr_order = strip[strip.values > 0]
-        new_order = pd.Series([self.run_sorter_on(x, s_string) for x in curr_order.keys()], curr_order.keys())
-        new_order = new_order.sort_values(ascending=True)
-        return len(new_order)-new_order.searchsorted(self.run_sorter_on(task, s_string), side="right")+1
-
-    # return dict form of tasks
+        if shelf not in self.sort_keys:
+            self.resort_shelf(shelf)
+        if shelf not in self.sort_keys:
+            raise RuleError("Sorter for " + shelf + " can't be used")
+        keys = self.sort_keys[shelf]
+        sorter = self.compiled_sorter(self.shelfdf.at[shelf, "sorter_string"])
+
+        # a task already in the shelf keeps its ticket so it stays in place among ties
+        if task in keys:
+            ticket = keys[task][1]
+        else:
+            self.sort_ticket += 1
+            ticket = self.sort_ticket
+        sort_key = (sorter.comparable_keys(self.taskdf, [task])[0], ticket)
+
+        index = self.nesting.count_tasks_before(shelf, lambda t: keys[t] < sort_key) + 1
+        # the task doesn't count itself if it is already before its new spot
+        if task in keys and keys[task] < sort_key:
+            index -= 1
+        return index, sort_key
+
+    # return dict form of tasks, with missing values as None
     def get_task_info(self, task_list):
-        return self.taskdf.loc[task_list].to_dict("index")
+        return Model.plain_records(self.taskdf.loc[task_list])
 
-    # return dict form of shelves
+    # return dict form of shelves, with missing values as None
     def get_shelf_info(self, shelf_list):
-        return self.shelfdf.loc[shelf_list].to_dict("index")
+        return Model.plain_records(self.shelfdf.loc[shelf_list])
+
+    # return dict of every task column to the dtype it is stored as
+    def task_dtypes(self):
+        return {k: Model.type_to_dtype[v] for (k, v) in self.task_types().items()}
+
+    # return dict of every shelf column to the dtype it is stored as
+    def shelf_dtypes(self):
+        return {k: Model.type_to_dtype[v] for (k, v) in self.shelfattributes.items()}
+
+    # build a dataframe with exactly the given columns in their dtypes, converting the ones present in df
+    # columns missing from df are filled with missing values
+    @staticmethod
+    def typed_frame(df, dtypes):
+        columns = {}
+        for (col, dtype) in dtypes.items():
+            values = df[col] if col in df.columns else pd.Series(pd.NA, index=df.index, dtype=object)
+            columns[col] = Model.typed_series(values, dtype)
+        return pd.DataFrame(columns, index=df.index)
+
+    # dataframe of the attributes of shelf or task elements, with an unnamed index like the frames the model builds
+    @staticmethod
+    def records_frame(records):
+        return pd.DataFrame.from_records(records, index="index").rename_axis(None)
+
+    # convert a column to a dtype, reading values written as text and treating unreadable values as missing
+    @staticmethod
+    def typed_series(values, dtype):
+        if values.dtype == pd.api.types.pandas_dtype(dtype):
+            return values
+        elif dtype == "datetime64[ns]":
+            # text is read as iso 8601 so that values written with different precisions are all read
+            date_format = None if pd.api.types.is_numeric_dtype(values) else "ISO8601"
+            return pd.to_datetime(values, errors="coerce", format=date_format).astype(dtype)
+        elif dtype == "boolean":
+            return values.map({True: True, False: False, "True": True, "False": False}).astype(dtype)
+        elif dtype in ("Float64", "Int32"):
+            return pd.to_numeric(values, errors="coerce").astype(dtype)
+        return values.astype(dtype)
+
+    # dict of row index to dict of column values, with plain python values and None for missing ones
+    @staticmethod
+    def plain_records(df):
+        return df.astype(object).where(df.notna(), None).to_dict("index")
 
     # return ordered list of shelves in task
     def get_subshelves(self, task):
-        strip = self.nestmat[task]
-        series = strip[strip.values < 0]
-        sorted_list = sorted(series.keys(), key=series.get)
-        sorted_list.reverse()
-        return sorted_list
+        return self.nesting.shelves_in(task)
 
-    # return ordered list of shelves that own this task
+    # return list of shelves that own this task
     def get_supershelves(self, task, include_index=False):
-        strip = self.nestmat[task]
-        series = strip[strip.values > 0]
+        shelves = self.nesting.shelves_holding(task)
         if include_index:
-            plain_list = list(series.items())
-        else:
-            plain_list = series.keys()
-        return plain_list
+            return [(s, self.nesting.task_position(s, task)) for s in shelves]
+        return shelves
 
     # return ordered list of tasks in shelf
     def get_subtasks(self, shelf):
-        strip = self.nestmat.loc[shelf]
-        series = strip[strip.values > 0]
-        sorted_list = sorted(series.keys(), key=series.get)
-        return sorted_list
+        return self.nesting.tasks_in(shelf)
 
-    # return ordered list of tasks that own this shelf
+    # return list of tasks that own this shelf
     def get_supertasks(self, shelf, include_index=False):
-        strip = self.nestmat.loc[shelf]
-        series = strip[strip.values < 0]
+        tasks = self.nesting.tasks_holding(shelf)
         if include_index:
-            plain_list = [(k, -v) for (k, v) in series.items()]
-        else:
-            plain_list = series.keys()
-        return plain_list
+            return [(t, self.nesting.shelf_position(t, shelf)) for t in tasks]
+        return tasks
 
     # return list of tasks that have a non-none value for the field
     def get_tasks_by_field(self, field):
         return self.taskdf.loc[self.taskdf[field].notnull()].index
 
-    def write_to_file(self, file):
-        # write header
-        file.write(bytes("<?xml version='1.0' encoding='utf-8'?>\n", 'utf-8'))
-        file.write(bytes("<data>\n", 'utf-8'))
-        # write shelfdf
-        if len(self.shelfdf.index) > 0:
-            self.shelfdf.to_xml(file, attr_cols=self.shelfdf.columns.tolist(), root_name="shelves", row_name="shelf",
-                                xml_declaration=False)
-        else:
-            file.write(bytes("<shelves/>\n", 'utf-8'))
-        # write taskfields
-        if len(self.taskfields) > 0:
-            file.write(bytes("<fields>\n", 'utf-8'))
-            for (k, v) in self.taskfields.items():
-                file.write(bytes("  <field>" + k + " gadget=" + v + "</field>\n", 'utf-8'))
-            file.write(bytes("</fields>\n", 'utf-8'))
+    # write the model as xml
+    # progress is called with the amount written so far and the total, and can raise Cancelled
+    def write_to_file(self, file, progress=None):
+        self.snapshot().write(file, False, progress)
+
+    # write the model in the binary columnar format, which holds everything write_to_file does
+    def write_to_binary(self, file, progress=None):
+        self.snapshot().write(file, True, progress)
+
+    # everything that is saved, as it is now, in a form that stays the same while the model changes
+    def snapshot(self):
+        return BoardSnapshot(self.shelfdf.copy(), self.taskdf.copy(), dict(self.taskfields),
+                             {c: list(items) for (c, items) in self.nesting.shelf_children.items() if len(items) > 0},
+                             {c: list(items) for (c, items) in self.nesting.task_children.items() if len(items) > 0},
+                             list(self.rack), self.stage, dict(self.labels.high_water), self.version)
+
+    # take a snapshot that will be saved elsewhere, after which changes are journaled on top of it
+    # the board only counts as saved once the snapshot is written and snapshot_saved is called,
+    # and snapshot_not_saved puts the changes before it back if it never is
+    def snapshot_for_save(self):
+        snapshot = self.snapshot()
+        self.saving = (self.unsaved, self.nesting.changed, self.journaled_path, self.journal_entries)
+        self.unsaved = UnsavedChanges()
+        self.nesting.changed = set()
+        self.journaled_path = None
+        return snapshot
+
+    # load the model from a .tood file, reading the file once, and replay its journal if it has one
+    # progress is called with the amount read so far and the total, and can raise Cancelled
+    def read_from_file(self, file, progress=None):
+        self.load_contents(read_tood(file.name, progress), file.name)
+
+    # load the model from a file written by write_to_binary, and replay its journal if it has one
+    def read_from_binary(self, file, progress=None):
+        self.load_contents(read_binary(file.name, progress), file.name)
+
+    # take over everything loaded into another model, as if it had been read into this one
+    def adopt(self, other):
+        vars(self).update(vars(other))
+        self.notify("new_model_loaded", self.taskfields, self.stage if self.stage is not None else "", self.rack)
+
+    # true if the next save of a board can be appended to its journal rather than rewriting it
+    def can_journal(self, path):
+        return (self.journaled_path == os.path.abspath(path) and os.path.exists(path)
+                and self.journal_entries < Model.journal_entry_limit
+                and journal_size(path) <= Model.journal_size_limit * os.path.getsize(path))
+
+    # append the changes since the last save to the journal of a board
+    def write_journal_entry(self, path):
+        if not self.unsaved.is_empty(self.nesting):
+            append_journal(path, self.unsaved.entry(self))
+            self.journal_entries += 1
+        self.mark_saved()
+
+    # after a snapshot from snapshot_for_save was written to a path, start a new journal for it or drop the old one
+    @pyqtSlot(str, bool, int)
+    def snapshot_saved(self, path, journaled, version):
+        self.saving = None
+        self.saved_version = version
+        if journaled:
+            start_journal(path)
+            self.journaled_path = os.path.abspath(path)
         else:
-            file.write(bytes("<fields/>\n", 'utf-8'))
-        # write taskdf
-        if len(self.taskdf.index) > 0:
-            self.taskdf.to_xml(file, attr_cols=self.taskdf.columns.tolist(), root_name="tasks", row_name="task",
-                               xml_declaration=False)
+            discard_journal(path)
+            self.journaled_path = None
+        self.journal_entries = 0
+
+    # after a snapshot from snapshot_for_save failed to be written or was cancelled,
+    # count the changes before it as unsaved again, and keep journaling to the board there was before
+    @pyqtSlot()
+    def snapshot_not_saved(self):
+        (unsaved, changed, self.journaled_path, self.journal_entries) = self.saving
+        self.saving = None
+        unsaved.include(self.unsaved)
+        self.unsaved = unsaved
+        self.nesting.changed = changed | self.nesting.changed
+
+    # forget changes, as they are all saved
+    def mark_saved(self):
+        self.unsaved = UnsavedChanges()
+        self.nesting.changed = set()
+        self.saved_version = self.version
+
+    # number of changes made since the model was last saved or loaded
+    def changes_since_save(self):
+        return self.version - self.saved_version
+
+    # apply a journal entry to a model that was just read from the board the journal belongs to
+    # this is done before filters and sorters are indexed, and seen counts are recounted afterwards
+    def apply_journal_entry(self, entry):
+        for op in entry["field_ops"]:
+            self.apply_field_op(op)
+        self.taskfields = entry["fields"]
+
+        self.shelfdf, added, erased = Model.merged_rows(self.shelfdf, entry["shelves"], self.shelf_dtypes())
+        for s in erased:
+            self.nesting.remove_shelf(s)
+        for s in added:
+            self.nesting.add_shelf(s)
+        self.taskdf, added, erased = Model.merged_rows(self.taskdf, entry["tasks"], self.task_dtypes())
+        for t in erased:
+            self.nesting.remove_task(t)
+        for t in added:
+            self.nesting.add_task(t)
+
+        # empty every changed shelf and task before filling them again, so no link is added while an old one
+        # that could close a loop is still there
+        for shelf in entry["shelf_tasks"]:
+            self.nesting.remove_tasks(shelf, self.nesting.tasks_in(shelf))
+        for task in entry["task_shelves"]:
+            for shelf in self.nesting.shelves_in(task):
+                self.nesting.place_shelf(task, shelf, 0)
+        for (shelf, tasks) in entry["shelf_tasks"].items():
+            self.nesting.append_tasks(shelf, tasks)
+        for (task, shelves) in entry["task_shelves"].items():
+            self.nesting.append_shelves(task, shelves)
+
+        if "rack" in entry:
+            self.rack = entry["rack"]
+        if "stage" in entry:
+            self.stage = entry["stage"]
+        self.labels.high_water.update(entry["labels"])
+
+    # write rows given as dicts of plain values into a typed dataframe, dropping the ones given as None
+    # return the new dataframe and the lists of ids added to and dropped from it
+    @staticmethod
+    def merged_rows(df, rows, dtypes):
+        erased = [i for (i, r) in rows.items() if r is None and i in df.index]
+        df = df.drop(index=erased)
+        values = {i: r for (i, r) in rows.items() if r is not None}
+        if len(values) == 0:
+            return df, [], erased
+        new_rows = Model.typed_frame(pd.DataFrame.from_dict(values, orient="index"), dtypes)
+        existing = [i for i in new_rows.index if i in df.index]
+        added = [i for i in new_rows.index if i not in df.index]
+        for col in df.columns:
+            df.loc[existing, col] = new_rows.loc[existing, col]
+        new_rows = new_rows.loc[added]
+        df = new_rows if len(df.index) == 0 else pd.concat([df, new_rows])
+        return df, added, erased
+
+    # replace the model with the contents read from a file, and the journal saved after it if there is one
+    # progress is called with the number of shelves and tasks whose nesting is built so far and the total
+    def load_contents(self, contents, path=None, progress=None):
+        self.rack = contents.rack
+        self.stage = contents.stage
+        saved_labels = contents.labels
+
+        # shelf dataframe
+        if contents.shelfdf is not None and len(contents.shelfdf.index) > 0:
+            self.shelfdf = Model.typed_frame(contents.shelfdf, self.shelf_dtypes())
+        elif len(contents.shelves) > 0:
+            self.shelfdf = Model.typed_frame(Model.records_frame(contents.shelves), self.shelf_dtypes())
         else:
-            file.write(bytes("<tasks/>\n", 'utf-8'))
-        # write nestmat
-        if len(self.nestmat.index) > 0:
-            self.nestmat.replace(0, None).to_xml(file, attr_cols=self.nestmat.columns.tolist(), root_name="nesting",
-                                                 row_name="shelf", xml_declaration=False)
-        else:
-            file.write(bytes("<nesting/>\n", 'utf-8'))
-        # write rack
-        if len(self.rack) > 0:
-            file.write(bytes("<rack>\n", 'utf-8'))
-            for x in self.rack:
-                file.write(bytes("  <shelf>"+x+"</shelf>\n", 'utf-8'))
-            file.write(bytes("</rack>\n", 'utf-8'))
-        else:
-            file.write(bytes("<rack/>\n", 'utf-8'))
-        # write stage
-        if self.stage is not None:
-            file.write(bytes("<stage>\n", 'utf-8'))
-            file.write(bytes("  <task>"+self.stage+"</task>\n", 'utf-8'))
-            file.write(bytes("</stage>\n", 'utf-8'))
+            self.shelfdf = Model.typed_frame(pd.DataFrame(), self.shelf_dtypes())
+        if len(self.shelfdf.index) > 0:
+            # fill columns that can't be missing
+            for col in Model.required_shelf_columns:
+                self.shelfdf[col] = self.shelfdf[col].fillna(self.shelfattributes[col]())
+
+        # custom task fields
+        self.taskfields = contents.fields
+
+        # task dataframe, converted to the typed columns with fields missing from the file added
+        if contents.taskdf is not None and len(contents.taskdf.index) > 0:
+            self.taskdf = Model.typed_frame(contents.taskdf, self.task_dtypes())
+        elif len(contents.tasks) > 0:
+            self.taskdf = Model.typed_frame(Model.records_frame(contents.tasks), self.task_dtypes())
         else:
-            file.write(bytes("<stage/>\n", 'utf-8'))
-        file.write(bytes("</data>\n", 'utf-8'))
-
-    def read_from_file(self, file):
-        # only read from structures that exist
-        has_data = {}
-        # find rack and stage values
-        with open(file.name, "r+") as file:
-            data = bytes(mmap.mmap(file.fileno(), 0))
-            data_sects = ["shelves", "fields", "tasks", "nesting", "rack", "stage"]
-            for d_s in data_sects:
-                has_data[d_s] = re.search(bytes("<"+d_s+">", 'utf-8'), data) is not None and \
-                                re.search(bytes("</"+d_s+">", 'utf-8'), data) is not None
-
-            if has_data["rack"]:
-                rack_loc = re.search(re.compile(b"(?<=<rack>).*(?=</rack>)", flags=re.DOTALL), data).span()
-                shelf_racks = re.findall(re.compile(b"(?<=<shelf>)\n?.*\n?(?=</shelf>)"), data[rack_loc[0]:rack_loc[1]])
-                self.rack = [str(x, 'UTF-8') for x in shelf_racks]
-            else:
-                self.rack = []
+            self.taskdf = Model.typed_frame(pd.DataFrame(), self.task_dtypes())
+
+        # filters and sorters compiled against the previous fields are no longer valid
+        self.filters = {}
+        self.sorters = {}
 
-            if has_data["stage"]:
-                stage_loc = re.search(re.compile(b"(?<=<stage>).*(?=</stage>)", flags=re.DOTALL), data).span()
-                task_stage = re.findall(re.compile(b"(?<=<task>)\n?.*\n?(?=</task>)"), data[stage_loc[0]:stage_loc[1]])
-                self.stage = str(task_stage[0], 'UTF-8')
+        # restore label marks, scanning existing labels only for files saved without them
+        self.labels = LabelAllocator()
+        for (prefix, df) in [("t", self.taskdf), ("s", self.shelfdf)]:
+            if prefix in saved_labels:
+                self.labels.high_water[prefix] = saved_labels[prefix]
             else:
-                self.stage = None
-
-        # open shelf dataframe
-        if has_data["shelves"]:
-            with open(file.name, "r") as file:
-                self.shelfdf = pd.read_xml(file, xpath="/data/shelves/shelf").set_index("index")
-                # fix NA data types
-                self.shelfdf["filter_string"] = self.shelfdf["filter_string"].fillna("")
-                self.shelfdf["sorter_string"] = self.shelfdf["sorter_string"].fillna("")
+                self.labels.rebuild(df.index, prefix=prefix)
+
+        # open nesting
+        self.nesting = NestingStore()
+        for s in self.shelfdf.index:
+            self.nesting.add_shelf(s)
+        for t in self.taskdf.index:
+            self.nesting.add_task(t)
+        total = len(contents.shelf_tasks) + len(contents.task_shelves)
+        for (i, (s, tasks)) in enumerate(contents.shelf_tasks.items()):
+            self.nesting.append_tasks(s, [t for (_, t) in sorted(tasks)])
+            if progress is not None and i % 100 == 0:
+                progress(i, total)
+        for (i, (t, shelves)) in enumerate(contents.task_shelves.items(), start=len(contents.shelf_tasks)):
+            self.nesting.append_shelves(t, [s for (_, s) in sorted(shelves)])
+            if progress is not None and i % 100 == 0:
+                progress(i, total)
+
+        # changes journaled since the board was written
+        journal = read_journal(path) if path is not None else None
+        if journal is not None:
+            for entry in journal:
+                self.apply_journal_entry(entry)
+            if len(journal) > 0:
+                self.recount_seen()
+        self.journaled_path = os.path.abspath(path) if journal is not None else None
+        self.journal_entries = len(journal) if journal is not None else 0
+
+        self.reindex_filters()
+        self.sort_keys = {}
+        self.reindex_sorters()
+        # whatever indexing changes is done again on every load, so it isn't a change to save
+        self.mark_saved()
+
+        self.notify("new_model_loaded", self.taskfields, self.stage if self.stage is not None else "", self.rack)
+
+
+# convert a board between the xml and binary .tood formats, each chosen by the extension of its path
+def convert_tood(source, destination):
+    model = Model()
+    with open(source, "rb") as file:
+        if is_binary_path(source):
+            model.read_from_binary(file)
         else:
-            self.shelfdf = pd.DataFrame(columns=list(self.shelfattributes.keys()))
-
-        # read in custom task fields
-        if has_data["fields"]:
-            fields_loc = re.search(re.compile(b"(?<=<fields>).*(?=</fields>)", flags=re.DOTALL), data).span()
-            field_list = re.findall(re.compile(b"(?<=<field>)\n?.*\n?(?=</field>)"), data[fields_loc[0]:fields_loc[1]])
-            self.taskfields = {str(x, 'UTF-8').split(" gadget=")[0] :
-                                   str(x, 'UTF-8').split(" gadget=")[1]for x in field_list}
-
-        # open task dataframe
-        if has_data["tasks"]:
-            with open(file.name, "r") as file:
-                self.taskdf = pd.read_xml(file, xpath="/data/tasks/task").set_index("index")
-
-            # add fields missing from task df
-            missing_col = pd.Series([fi for fi in self.taskfields.keys() if fi not in self.taskdf.columns])
-            mis_c_df = pd.DataFrame(columns=missing_col)
-            self.taskdf = pd.concat([self.taskdf, mis_c_df], axis=1)
+            model.read_from_file(file)
+    with atomic_write(destination) as file:
+        if is_binary_path(destination):
+            model.write_to_binary(file)
         else:
-            self.taskdf = pd.DataFrame(columns=list(self.taskattributes)+list(self.taskfields))
-
-        # open nesting matrix
-        if has_data["nesting"]:
-            with open(file.name, "r") as file:
-                self.nestmat = (pd.read_xml(file, xpath="/data/nesting/shelf")  # read entries
-                                  .set_index("index")  # set dataframe index to index column
-                                  .fillna(0)  # replace missing values with 0 (for no nesting)
-                                  .astype(int))  # convert floats to integers
-
-                # add shelves missing from matrix
-                missing_row = pd.Series([si for si in self.shelfdf.index if si not in self.nestmat.index])
-                mis_r_df = pd.DataFrame(index=missing_row)
-                self.nestmat = pd.concat([self.nestmat, mis_r_df])
-
-                # add tasks missing from matrix
-                missing_col = pd.Series([ti for ti in self.taskdf.index if ti not in self.nestmat.columns])
-                mis_c_df = pd.DataFrame(columns=missing_col)
-                self.nestmat = pd.concat([self.nestmat, mis_c_df], axis=1)
-
-                self.nestmat = self.nestmat.fillna(0.0)
-        else:
-            self.nestmat = pd.DataFrame()
+            model.write_to_file(file)
+
 
-        self.new_model_loaded.emit(self.taskfields, self.stage if self.stage is not None else "", self.rack)
+if __name__ == "__main__":
+    import sys
+    convert_tood(sys.argv[1], sys.argv[2])
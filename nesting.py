@@ -0,0 +1,474 @@
+from random import random
+
+
+class OrderedSequence:
+    # order-statistic sequence of unique items, stored as a randomized treap keyed implicitly by position
+    # inserting, removing, and finding the position of an item all take O(log n) in the length of the sequence
+    # positions are 1-indexed
+
+    class Node:
+        __slots__ = ("item", "priority", "size", "left", "right", "parent")
+
+        def __init__(self, item):
+            self.item = item
+            self.priority = random()
+            self.size = 1
+            self.left = None
+            self.right = None
+            self.parent = None
+
+    def __init__(self, items=()):
+        self.root = None
+        # node for each item so positions can be found by walking up from the item
+        self.nodes = {}
+        for x in items:
+            self.insert(len(self.nodes) + 1, x)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, item):
+        return item in self.nodes
+
+    # in-order traversal
+    def __iter__(self):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.item
+            node = node.right
+
+    # put item at a position, shifting later items back
+    def insert(self, idx, item):
+        node = OrderedSequence.Node(item)
+        self.nodes[item] = node
+        left, right = OrderedSequence.split(self.root, idx - 1)
+        self.set_root(OrderedSequence.merge(OrderedSequence.merge(left, node), right))
+
+    # put many items at the end in order, building their part of the tree in linear time
+    def extend(self, items):
+        nodes = [OrderedSequence.Node(x) for x in items]
+        if len(nodes) == 0:
+            return
+        # link nodes into a tree ordered by position and heap-ordered by priority
+        stack = []
+        for node in nodes:
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        # fix sizes and parents from the bottom up
+        order = []
+        pending = [stack[0]]
+        while pending:
+            node = pending.pop()
+            order.append(node)
+            pending.extend(c for c in (node.left, node.right) if c is not None)
+        for node in reversed(order):
+            OrderedSequence.update(node)
+        for node in nodes:
+            self.nodes[node.item] = node
+        self.set_root(OrderedSequence.merge(self.root, stack[0]))
+
+    # take item out of the sequence, return the position it had
+    def remove(self, item):
+        idx = self.position(item)
+        left, right = OrderedSequence.split(self.root, idx - 1)
+        _, right = OrderedSequence.split(right, 1)
+        self.nodes.pop(item)
+        self.set_root(OrderedSequence.merge(left, right))
+        return idx
+
+    # take many items out of the sequence, return a dict of the positions they had
+    def remove_many(self, items):
+        positions = {x: self.position(x) for x in items}
+        if len(positions) * 8 < len(self.nodes):
+            for x in positions:
+                self.remove(x)
+        else:
+            # cheaper to rebuild from what remains when most of the sequence is going
+            remaining = [x for x in self if x not in positions]
+            self.root = None
+            self.nodes = {}
+            self.extend(remaining)
+        return positions
+
+    # position of item in the sequence
+    def position(self, item):
+        node = self.nodes[item]
+        idx = OrderedSequence.size(node.left) + 1
+        while node.parent is not None:
+            if node is node.parent.right:
+                idx += OrderedSequence.size(node.parent.left) + 1
+            node = node.parent
+        return idx
+
+    # number of items at the front of the sequence for which is_before is true
+    # is_before must be true for every item up to some point and false after it
+    def count_before(self, is_before):
+        count = 0
+        node = self.root
+        while node is not None:
+            if is_before(node.item):
+                count += OrderedSequence.size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    # item at a position in the sequence
+    def item_at(self, idx):
+        node = self.root
+        while node is not None:
+            left_size = OrderedSequence.size(node.left)
+            if idx <= left_size:
+                node = node.left
+            elif idx == left_size + 1:
+                return node.item
+            else:
+                idx -= left_size + 1
+                node = node.right
+        raise IndexError("position out of range")
+
+    def set_root(self, node):
+        self.root = node
+        if node is not None:
+            node.parent = None
+
+    @staticmethod
+    def size(node):
+        return 0 if node is None else node.size
+
+    # recompute size of node and point its children back at it
+    @staticmethod
+    def update(node):
+        node.size = 1 + OrderedSequence.size(node.left) + OrderedSequence.size(node.right)
+        if node.left is not None:
+            node.left.parent = node
+        if node.right is not None:
+            node.right.parent = node
+
+    # split tree into the first k items and the rest
+    @staticmethod
+    def split(node, k):
+        if node is None:
+            return None, None
+        if OrderedSequence.size(node.left) >= k:
+            left, node.left = OrderedSequence.split(node.left, k)
+            OrderedSequence.update(node)
+            return left, node
+        else:
+            node.right, right = OrderedSequence.split(node.right, k - OrderedSequence.size(node.left) - 1)
+            OrderedSequence.update(node)
+            return node, right
+
+    # join two trees where every item in a comes before every item in b
+    @staticmethod
+    def merge(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.priority > b.priority:
+            a.right = OrderedSequence.merge(a.right, b)
+            OrderedSequence.update(a)
+            return a
+        else:
+            b.left = OrderedSequence.merge(a, b.left)
+            OrderedSequence.update(b)
+            return b
+
+
+class ReachabilityIndex:
+    # transitive closure of the nesting tree, kept up to date as links are added and removed
+    # tasks and shelves share one index since their ids never overlap
+    # each ancestor/descendant pair stores its number of distinct paths, so a link can be removed without
+    # rewalking the tree: the pair stays reachable until its count drops to zero
+
+    def __init__(self):
+        # path counts from each node to everything below it
+        self.descendants = {}
+        # path counts to each node from everything above it
+        self.ancestors = {}
+
+    # returns true if descendant is anywhere below ancestor
+    def reaches(self, ancestor, descendant):
+        return descendant in self.descendants.get(ancestor, ())
+
+    # returns true if putting child directly under parent would create circular nesting
+    def would_cycle(self, parent, child):
+        return parent == child or self.reaches(child, parent)
+
+    def link(self, parent, child):
+        return self.adjust(parent, child, 1)
+
+    def unlink(self, parent, child):
+        return self.adjust(parent, child, -1)
+
+    # drop a node that has no remaining links
+    def forget(self, node):
+        self.descendants.pop(node, None)
+        self.ancestors.pop(node, None)
+
+    # add or subtract the paths that pass through the link from parent to child
+    # return the nodes whose descendants changed
+    def adjust(self, parent, child, sign):
+        above = dict(self.ancestors.get(parent, {}))
+        above[parent] = 1
+        below = dict(self.descendants.get(child, {}))
+        below[child] = 1
+        for (a, a_paths) in above.items():
+            a_descendants = self.descendants.setdefault(a, {})
+            for (d, d_paths) in below.items():
+                count = a_descendants.get(d, 0) + sign * a_paths * d_paths
+                if count == 0:
+                    a_descendants.pop(d)
+                    self.ancestors[d].pop(a)
+                else:
+                    a_descendants[d] = count
+                    self.ancestors.setdefault(d, {})[a] = count
+        return above.keys()
+
+
+class NestingStore:
+    # sparse record of the ordering of tasks within shelves and shelves within tasks
+    # children are kept in ordered sequences and parents in reverse maps, so memory grows with the number of links
+    # positions are 1-indexed to match the signals emitted by the model, and 0 means not nested
+
+    def __init__(self):
+        # ordered tasks inside each shelf
+        self.shelf_children = {}
+        # ordered shelves inside each task
+        self.task_children = {}
+        # shelves that hold each task (dict used as an insertion-ordered set)
+        self.task_parents = {}
+        # tasks that hold each shelf (dict used as an insertion-ordered set)
+        self.shelf_parents = {}
+        # everything above and below each shelf and task
+        self.reach = ReachabilityIndex()
+        # descendants of a shelf or task split by kind, dropped when the nesting below that node changes
+        self.descendant_cache = {}
+        # while recording, a list of functions that each undo one change, in the order the changes were made
+        self.journal = None
+        # shelves and tasks whose children changed, for saving just the changes
+        self.changed = set()
+
+    def __str__(self):
+        lines = [s + ": " + ", ".join(tasks) for (s, tasks) in self.shelf_children.items() if len(tasks) > 0]
+        lines += [t + ": " + ", ".join(shelves) for (t, shelves) in self.task_children.items() if len(shelves) > 0]
+        return "\n".join(lines) if len(lines) > 0 else "(no nesting)"
+
+    # start recording changes so they can be undone
+    def begin_journal(self):
+        self.journal = []
+
+    # stop recording changes, keeping them
+    def end_journal(self):
+        self.journal = None
+
+    # undo every change made since recording began, most recent first, and stop recording
+    def rollback_journal(self):
+        journal = self.journal
+        self.journal = None
+        for undo in reversed(journal):
+            undo()
+
+    def record(self, undo):
+        if self.journal is not None:
+            self.journal.append(undo)
+
+    # register a new shelf with no links
+    def add_shelf(self, shelf):
+        self.shelf_children[shelf] = OrderedSequence()
+        self.shelf_parents[shelf] = {}
+        self.record(lambda: self.remove_shelf(shelf))
+
+    # register a new task with no links
+    def add_task(self, task):
+        self.task_children[task] = OrderedSequence()
+        self.task_parents[task] = {}
+        self.record(lambda: self.remove_task(task))
+
+    # forget a shelf and every link to or from it
+    def remove_shelf(self, shelf):
+        if self.journal is not None:
+            self.record(self.restorer(shelf, self.add_shelf, self.append_tasks, self.place_shelf,
+                                      self.tasks_in(shelf), self.shelves_holding_positions(shelf)))
+        for task in self.shelf_children.pop(shelf):
+            self.task_parents[task].pop(shelf)
+            self.invalidate(self.reach.unlink(shelf, task))
+        for task in self.shelf_parents.pop(shelf):
+            self.task_children[task].remove(shelf)
+            self.changed.add(task)
+            self.invalidate(self.reach.unlink(task, shelf))
+        self.reach.forget(shelf)
+        self.invalidate([shelf])
+
+    # forget a task and every link to or from it
+    def remove_task(self, task):
+        if self.journal is not None:
+            self.record(self.restorer(task, self.add_task, self.append_shelves, self.place_task,
+                                      self.shelves_in(task), self.tasks_holding_positions(task)))
+        for shelf in self.task_children.pop(task):
+            self.shelf_parents[shelf].pop(task)
+            self.invalidate(self.reach.unlink(task, shelf))
+        for shelf in self.task_parents.pop(task):
+            self.shelf_children[shelf].remove(task)
+            self.changed.add(shelf)
+            self.invalidate(self.reach.unlink(shelf, task))
+        self.reach.forget(task)
+        self.invalidate([task])
+
+    # ordered tasks in a shelf
+    def tasks_in(self, shelf):
+        return list(self.shelf_children[shelf])
+
+    # ordered shelves in a task
+    def shelves_in(self, task):
+        return list(self.task_children[task])
+
+    # shelves that directly hold a task
+    def shelves_holding(self, task):
+        return list(self.task_parents[task])
+
+    # tasks that directly hold a shelf
+    def tasks_holding(self, shelf):
+        return list(self.shelf_parents[shelf])
+
+    def count_tasks_in(self, shelf):
+        return len(self.shelf_children[shelf])
+
+    def count_shelves_in(self, task):
+        return len(self.task_children[task])
+
+    # position of task in shelf, 0 if it isn't there
+    def task_position(self, shelf, task):
+        if shelf not in self.task_parents[task]:
+            return 0
+        return self.shelf_children[shelf].position(task)
+
+    # position of shelf in task, 0 if it isn't there
+    def shelf_position(self, task, shelf):
+        if task not in self.shelf_parents[shelf]:
+            return 0
+        return self.task_children[task].position(shelf)
+
+    # add, move, or remove (idx of 0) a task in a shelf, return its previous position
+    def place_task(self, shelf, task, idx):
+        prev_idx = self.place(self.shelf_children[shelf], self.task_parents[task], shelf, task, idx)
+        self.changed.add(shelf)
+        self.record(lambda: self.place_task(shelf, task, prev_idx))
+        return prev_idx
+
+    # add, move, or remove (idx of 0) a shelf in a task, return its previous position
+    def place_shelf(self, task, shelf, idx):
+        prev_idx = self.place(self.task_children[task], self.shelf_parents[shelf], task, shelf, idx)
+        self.changed.add(task)
+        self.record(lambda: self.place_shelf(task, shelf, prev_idx))
+        return prev_idx
+
+    # remove many tasks from a shelf, all of which must be in it, return a dict of the positions they had
+    def remove_tasks(self, shelf, tasks):
+        positions = self.shelf_children[shelf].remove_many(tasks)
+        self.changed.add(shelf)
+        for task in tasks:
+            self.task_parents[task].pop(shelf)
+            self.invalidate(self.reach.unlink(shelf, task))
+        # putting tasks back from the front restores the positions they had
+        self.record(lambda: [self.place_task(shelf, t, positions[t]) for t in sorted(positions, key=positions.get)])
+        return positions
+
+    # add many tasks to the end of a shelf, none of which can already be in it
+    def append_tasks(self, shelf, tasks):
+        self.shelf_children[shelf].extend(tasks)
+        self.changed.add(shelf)
+        for task in tasks:
+            self.task_parents[task][shelf] = None
+            self.invalidate(self.reach.link(shelf, task))
+        self.record(lambda: self.remove_tasks(shelf, tasks))
+
+    # add many shelves to the end of a task, none of which can already be in it
+    def append_shelves(self, task, shelves):
+        self.task_children[task].extend(shelves)
+        self.changed.add(task)
+        for shelf in shelves:
+            self.shelf_parents[shelf][task] = None
+            self.invalidate(self.reach.link(task, shelf))
+        self.record(lambda: [self.place_shelf(task, s, 0) for s in shelves])
+
+    # (task, position) for every task that holds a shelf
+    def shelves_holding_positions(self, shelf):
+        return [(t, self.shelf_position(t, shelf)) for t in self.shelf_parents[shelf]]
+
+    # (shelf, position) for every shelf that holds a task
+    def tasks_holding_positions(self, task):
+        return [(s, self.task_position(s, task)) for s in self.task_parents[task]]
+
+    # function that registers a removed node again with the links it had
+    @staticmethod
+    def restorer(node, add, append_children, place_in_parent, children, parent_positions):
+        def restore():
+            add(node)
+            append_children(node, children)
+            for (parent, pos) in parent_positions:
+                place_in_parent(parent, node, pos)
+        return restore
+
+    # number of tasks at the front of a shelf for which is_before is true, assuming the shelf is ordered by it
+    def count_tasks_before(self, shelf, is_before):
+        return self.shelf_children[shelf].count_before(is_before)
+
+    # rearrange the tasks of a shelf into a new order holding exactly the same tasks
+    def reorder_tasks(self, shelf, tasks):
+        if self.journal is not None:
+            previous = self.tasks_in(shelf)
+            self.record(lambda: self.reorder_tasks(shelf, previous))
+        order = OrderedSequence()
+        order.extend(tasks)
+        self.shelf_children[shelf] = order
+        self.changed.add(shelf)
+
+    # returns true if the shelf or task is anywhere below the other one in the nesting tree
+    def is_below(self, node, above):
+        return self.reach.reaches(above, node)
+
+    # tasks and shelves anywhere below a shelf or task, as two dicts of id to number of paths reaching it
+    def descendants_of(self, node):
+        if node not in self.descendant_cache:
+            tasks = {}
+            shelves = {}
+            for (d, paths) in self.reach.descendants.get(node, {}).items():
+                if d in self.task_children:
+                    tasks[d] = paths
+                else:
+                    shelves[d] = paths
+            self.descendant_cache[node] = (tasks, shelves)
+        return self.descendant_cache[node]
+
+    # drop cached descendants of nodes whose nesting changed
+    def invalidate(self, nodes):
+        for n in nodes:
+            self.descendant_cache.pop(n, None)
+
+    def place(self, children, parents, container, item, idx):
+        prev_idx = 0
+        if container in parents:
+            prev_idx = children.remove(item)
+            parents.pop(container)
+        if idx != 0:
+            children.insert(idx, item)
+            parents[container] = None
+
+        # moves within the container don't change what is reachable
+        if prev_idx == 0 and idx != 0:
+            self.invalidate(self.reach.link(container, item))
+        elif prev_idx != 0 and idx == 0:
+            self.invalidate(self.reach.unlink(container, item))
+        return prev_idx
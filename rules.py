@@ -0,0 +1,327 @@
+import re
+from functools import total_ordering
+import pandas as pd
+
+
+# raised when a filter or sorter string can't be understood
+class RuleError(ValueError):
+    pass
+
+
+# pieces of a rule string: numbers, quoted strings, comparison operators, parentheses, and names
+token_pattern = re.compile(r"\s*(?:(?P<number>-?\d+(?:\.\d*)?)|(?P<string>\"[^\"]*\"|'[^']*')|"
+                           r"(?P<op>==|!=|<=|>=|<|>|\(|\)|,)|(?P<name>[A-Za-z_]\w*))")
+
+# words that have a meaning of their own and can't be used as field names
+keywords = {"and", "or", "not", "contains", "true", "false", "none", "now", "today", "asc", "desc"}
+
+
+# split a rule string into (kind, text) tuples
+def tokenize(string):
+    tokens = []
+    pos = 0
+    string = string.rstrip()
+    while pos < len(string):
+        match = token_pattern.match(string, pos)
+        if match is None or match.end() == pos:
+            raise RuleError("Unexpected character '" + string[pos:].lstrip()[:1] + "' in rule")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+# convert a column to the type its field is declared as, so comparisons run on the whole column
+def typed_column(column, field_type):
+    if field_type == pd.Timestamp:
+        return pd.to_datetime(column, errors="coerce")
+    elif field_type in (float, int):
+        return pd.to_numeric(column, errors="coerce")
+    elif field_type == bool:
+        return column.fillna(False).astype(bool)
+    return column
+
+
+# turn the result of an expression into a boolean series over every row
+# typed columns can't be filled with a value of another type, so numbers are compared with zero
+def as_mask(value, df):
+    if isinstance(value, pd.Series):
+        if pd.api.types.is_bool_dtype(value.dtype):
+            return value.fillna(False).astype(bool)
+        elif pd.api.types.is_numeric_dtype(value.dtype):
+            return (value.fillna(0) != 0).astype(bool)
+        return value.astype(object).fillna(False).astype(bool)
+    return pd.Series(bool(value), index=df.index, dtype=bool)
+
+
+class Filter:
+    # filter expression compiled once into a function that evaluates every row of a task dataframe together
+    #
+    # grammar:
+    #   expression := term ("or" term)*
+    #   term       := factor ("and" factor)*
+    #   factor     := "not" factor | comparison
+    #   comparison := operand (("==" | "!=" | "<" | "<=" | ">" | ">=" | "contains") operand)?
+    #   operand    := field | number | "string" | true | false | none | now | today | "(" expression ")"
+    #
+    # a field on its own is true when its value is truthy, e.g. "not completed and value >= 2"
+    # an empty filter keeps the original behaviour of showing incomplete tasks
+
+    default_string = "not completed"
+
+    comparisons = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+    }
+
+    # types is a dict of every task column to the python type of its values
+    def __init__(self, string, types):
+        self.string = string
+        self.types = types
+        # task columns read by this filter
+        self.fields = set()
+
+        self.tokens = tokenize(string if string.strip() != "" else Filter.default_string)
+        self.pos = 0
+        self.evaluate = self.parse_expression()
+        if self.pos != len(self.tokens):
+            raise RuleError("Unexpected '" + self.tokens[self.pos][1] + "' in filter")
+        self.tokens = None
+
+    # boolean series of which rows of the dataframe pass the filter
+    def mask(self, taskdf):
+        try:
+            return as_mask(self.evaluate(taskdf), taskdf)
+        except TypeError:
+            raise RuleError("Filter compares values of different types")
+
+    # returns true if the task passes the filter
+    def passes(self, taskdf, task):
+        return bool(self.mask(taskdf.loc[[task]]).iloc[0])
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        if token[0] is None:
+            raise RuleError("Filter ends unexpectedly")
+        self.pos += 1
+        return token
+
+    def parse_expression(self):
+        left = self.parse_term()
+        while self.peek() == ("name", "or"):
+            self.take()
+            left = Filter.combine(left, self.parse_term(), lambda a, b: a | b)
+        return left
+
+    def parse_term(self):
+        left = self.parse_factor()
+        while self.peek() == ("name", "and"):
+            self.take()
+            left = Filter.combine(left, self.parse_factor(), lambda a, b: a & b)
+        return left
+
+    def parse_factor(self):
+        if self.peek() == ("name", "not"):
+            self.take()
+            inner = self.parse_factor()
+            return lambda df: ~as_mask(inner(df), df)
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left, left_type, left_quoted = self.parse_operand()
+        kind, text = self.peek()
+        if kind == "op" and text in Filter.comparisons:
+            self.take()
+            right, right_type, right_quoted = self.parse_operand()
+            return Filter.compare(left, left_type, left_quoted, text, right, right_type, right_quoted)
+        elif (kind, text) == ("name", "contains"):
+            self.take()
+            right, _, _ = self.parse_operand()
+            return Filter.contains(left, right)
+        return left
+
+    # return a function of the dataframe, the type of value it produces, and if it is a quoted string
+    def parse_operand(self):
+        kind, text = self.take()
+        if kind == "number":
+            value = float(text)
+            return (lambda df: value), float, False
+        elif kind == "string":
+            value = text[1:-1]
+            return (lambda df: value), str, True
+        elif kind == "op" and text == "(":
+            inner = self.parse_expression()
+            if self.take() != ("op", ")"):
+                raise RuleError("Missing ')' in filter")
+            return inner, bool, False
+        elif kind == "name" and text in ("true", "false"):
+            value = text == "true"
+            return (lambda df: value), bool, False
+        elif kind == "name" and text == "none":
+            return (lambda df: None), None, False
+        elif kind == "name" and text == "now":
+            return (lambda df: pd.Timestamp.now()), pd.Timestamp, False
+        elif kind == "name" and text == "today":
+            return (lambda df: pd.Timestamp.now().normalize()), pd.Timestamp, False
+        elif kind == "name" and text not in keywords:
+            if text not in self.types:
+                raise RuleError(text + " is not a task field")
+            self.fields.add(text)
+            field_type = self.types[text]
+            return (lambda df: typed_column(df[text], field_type)), field_type, False
+        raise RuleError("Unexpected '" + text + "' in filter")
+
+    @staticmethod
+    def combine(left, right, operation):
+        return lambda df: operation(as_mask(left(df), df), as_mask(right(df), df))
+
+    @staticmethod
+    def compare(left, left_type, left_quoted, op, right, right_type, right_quoted):
+        # comparing against none checks whether the value is missing
+        if left_type is None or right_type is None:
+            if op not in ("==", "!="):
+                raise RuleError("none can only be compared with == or !=")
+            other = right if left_type is None else left
+            if op == "==":
+                return lambda df: pd.isna(other(df))
+            return lambda df: pd.notna(other(df))
+
+        # read quoted dates as timestamps when compared with a date, while text fields can't be compared with dates
+        if left_type == pd.Timestamp and right_quoted:
+            right = Filter.as_timestamp(right)
+        elif right_type == pd.Timestamp and left_quoted:
+            left = Filter.as_timestamp(left)
+        elif Filter.type_group(left_type) != Filter.type_group(right_type):
+            raise RuleError("Can't compare " + left_type.__name__ + " with " + right_type.__name__)
+
+        operation = Filter.comparisons[op]
+        return lambda df: operation(left(df), right(df))
+
+    # text of the left operand containing the right one, which is compared row by row when it is a field
+    # a value on the left that isn't a field is the same for every row, and a missing value on the right is
+    # contained in nothing
+    @staticmethod
+    def contains(left, right):
+        def evaluate(df):
+            texts = left(df)
+            if not isinstance(texts, pd.Series):
+                texts = pd.Series(texts, index=df.index, dtype=object)
+            texts = texts.fillna("").astype(str)
+            part = right(df)
+            if isinstance(part, pd.Series):
+                return pd.Series([pd.notna(p) and str(p) in t for (t, p) in zip(texts, part)], index=texts.index,
+                                 dtype=bool)
+            return texts.str.contains(str(part), regex=False)
+        return evaluate
+
+    # types that can be compared with each other share a group
+    @staticmethod
+    def type_group(value_type):
+        return float if value_type in (int, float, bool) else value_type
+
+    @staticmethod
+    def as_timestamp(literal):
+        try:
+            value = pd.Timestamp(literal(None))
+        except ValueError:
+            raise RuleError("'" + literal(None) + "' is not a date")
+        return lambda df: value
+
+
+@total_ordering
+class Descending:
+    # wraps a sort key value so that it compares in reverse
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class Sorter:
+    # sorter string parsed into a list of typed sort keys, evaluated over every task of a shelf together
+    #
+    # grammar:
+    #   sorter := key ("," key)*
+    #   key    := field ("asc" | "desc")?
+    #
+    # keys are ascending unless marked desc, missing values always go last, and ties keep their current order
+    # an empty sorter keeps the original behaviour of ordering by the value field from high to low
+
+    default_string = "value desc"
+
+    # types is a dict of every task column to the python type of its values
+    def __init__(self, string, types):
+        self.string = string
+        # (field, type, ascending) for each key in order of priority
+        self.keys = []
+        # task columns read by this sorter
+        self.fields = set()
+
+        if string.strip() == "":
+            # without a value field an empty sorter leaves the order alone
+            if "value" not in types:
+                return
+            string = Sorter.default_string
+
+        tokens = tokenize(string)
+        pos = 0
+        while pos < len(tokens):
+            kind, text = tokens[pos]
+            if kind != "name" or text in keywords:
+                raise RuleError("Expected a field name in sorter but found '" + text + "'")
+            if text not in types:
+                raise RuleError(text + " is not a task field")
+            pos += 1
+            ascending = True
+            if pos < len(tokens) and tokens[pos] in (("name", "asc"), ("name", "desc")):
+                ascending = tokens[pos][1] == "asc"
+                pos += 1
+            self.keys.append((text, types[text], ascending))
+            self.fields.add(text)
+            if pos < len(tokens):
+                if tokens[pos] != ("op", ","):
+                    raise RuleError("Expected ',' in sorter but found '" + tokens[pos][1] + "'")
+                pos += 1
+                if pos == len(tokens):
+                    raise RuleError("Sorter ends unexpectedly")
+
+    # dataframe of the typed sort keys of the given tasks, one column per key
+    def key_frame(self, taskdf, tasks):
+        rows = taskdf.loc[tasks]
+        return pd.DataFrame({i: typed_column(rows[field], field_type)
+                             for (i, (field, field_type, _)) in enumerate(self.keys)}, index=rows.index)
+
+    # comparable sort keys of the given tasks, ordering the same way as the sorter
+    # missing values compare after any present value, and desc keys are wrapped to compare in reverse
+    def comparable_keys(self, taskdf, tasks):
+        keys = self.key_frame(taskdf, tasks)
+        comparable = []
+        for row in keys.itertuples(index=False):
+            comparable.append(tuple((1,) if pd.isna(v) else (0, v if k[2] else Descending(v))
+                                    for (v, k) in zip(row, self.keys)))
+        return comparable
+
+    # return the tasks rearranged into sorted order
+    def order(self, taskdf, tasks):
+        if len(self.keys) == 0 or len(tasks) == 0:
+            return list(tasks)
+        keys = self.key_frame(taskdf, tasks)
+        try:
+            keys = keys.sort_values(by=list(keys.columns), ascending=[k[2] for k in self.keys],
+                                    na_position="last", kind="stable")
+        except TypeError:
+            raise RuleError("Sorter field has values of different types")
+        return list(keys.index)
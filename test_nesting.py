@@ -0,0 +1,158 @@
+import random
+
+from model import Model
+from nesting import NestingStore, OrderedSequence, ReachabilityIndex
+
+
+# children in order, parents with the position held in each, and path counts below every node
+def nesting_state(store):
+    shelves = {s: (store.tasks_in(s), dict(store.shelves_holding_positions(s))) for s in store.shelf_children}
+    tasks = {t: (store.shelves_in(t), dict(store.tasks_holding_positions(t))) for t in store.task_children}
+    reach = {n: dict(d) for (n, d) in store.reach.descendants.items() if len(d) > 0}
+    return shelves, tasks, reach
+
+
+def small_store():
+    store = NestingStore()
+    for s in ["s1", "s2", "s3"]:
+        store.add_shelf(s)
+    for t in ["t1", "t2", "t3", "t4"]:
+        store.add_task(t)
+    store.append_tasks("s1", ["t1", "t2", "t3"])
+    store.place_shelf("t1", "s2", 1)
+    store.place_task("s2", "t4", 1)
+    store.place_task("s3", "t2", 1)
+    return store
+
+
+def test_positions_and_parents():
+    store = small_store()
+    assert store.tasks_in("s1") == ["t1", "t2", "t3"]
+    assert store.task_position("s1", "t3") == 3
+    assert store.task_position("s2", "t3") == 0
+    assert store.shelves_holding("t2") == ["s1", "s3"]
+    assert store.place_task("s1", "t3", 1) == 3
+    assert store.tasks_in("s1") == ["t3", "t1", "t2"]
+    assert store.remove_tasks("s1", ["t1", "t3"]) == {"t1": 2, "t3": 1}
+    assert store.tasks_in("s1") == ["t2"]
+    assert store.shelves_holding("t3") == []
+
+
+def test_rollback_restores_nesting():
+    store = small_store()
+    before = nesting_state(store)
+    store.begin_journal()
+    store.place_task("s1", "t3", 1)
+    store.place_shelf("t4", "s3", 1)
+    store.remove_tasks("s1", ["t1", "t2"])
+    store.append_tasks("s3", ["t3"])
+    store.reorder_tasks("s3", ["t3", "t2"])
+    store.add_shelf("s4")
+    store.place_shelf("t2", "s4", 1)
+    store.remove_task("t1")
+    store.remove_shelf("s2")
+    assert nesting_state(store) != before
+    store.rollback_journal()
+    assert nesting_state(store) == before
+    assert store.journal is None
+
+
+def test_rollback_clears_cached_descendants():
+    store = small_store()
+    assert store.descendants_of("s1") == ({"t1": 1, "t2": 1, "t3": 1, "t4": 1}, {"s2": 1})
+    store.begin_journal()
+    store.remove_shelf("s2")
+    assert store.descendants_of("s1") == ({"t1": 1, "t2": 1, "t3": 1}, {})
+    store.rollback_journal()
+    assert store.descendants_of("s1") == ({"t1": 1, "t2": 1, "t3": 1, "t4": 1}, {"s2": 1})
+
+
+def assert_matches(sequence, items):
+    assert list(sequence) == items
+    assert len(sequence) == len(items)
+    for (i, x) in enumerate(items):
+        assert sequence.position(x) == i + 1
+        assert sequence.item_at(i + 1) == x
+
+
+# random edits applied to an ordered sequence and to a plain list should leave them the same
+def test_ordered_sequence_against_list():
+    rng = random.Random(1)
+    sequence = OrderedSequence()
+    items = []
+    next_item = 0
+    for _ in range(400):
+        op = rng.random()
+        if op < 0.4 or len(items) == 0:
+            idx = rng.randint(1, len(items) + 1)
+            sequence.insert(idx, next_item)
+            items.insert(idx - 1, next_item)
+            next_item += 1
+        elif op < 0.6:
+            new = list(range(next_item, next_item + rng.randint(0, 5)))
+            sequence.extend(new)
+            items.extend(new)
+            next_item += len(new)
+        elif op < 0.85:
+            x = rng.choice(items)
+            assert sequence.remove(x) == items.index(x) + 1
+            items.remove(x)
+        else:
+            # a few items are removed one by one, most of them by rebuilding
+            gone = rng.sample(items, min(len(items), rng.choice([1, 2, rng.randint(1, len(items))])))
+            assert sequence.remove_many(gone) == {x: items.index(x) + 1 for x in gone}
+            items = [x for x in items if x not in gone]
+        assert_matches(sequence, items)
+
+
+def test_ordered_sequence_count_before():
+    sequence = OrderedSequence(range(10))
+    assert sequence.count_before(lambda x: x < 4) == 4
+    assert sequence.count_before(lambda x: False) == 0
+    assert sequence.count_before(lambda x: True) == 10
+
+
+# a reaches d along two paths, through b and through c
+def test_reachability_counts_paths():
+    reach = ReachabilityIndex()
+    for (parent, child) in [("a", "b"), ("a", "c"), ("b", "d"), ("c", "d"), ("d", "e")]:
+        reach.link(parent, child)
+    assert reach.descendants["a"] == {"b": 1, "c": 1, "d": 2, "e": 2}
+    assert reach.ancestors["e"] == {"d": 1, "b": 1, "c": 1, "a": 2}
+    reach.unlink("b", "d")
+    assert reach.reaches("a", "e")
+    assert not reach.reaches("b", "e")
+    assert reach.descendants["a"] == {"b": 1, "c": 1, "d": 1, "e": 1}
+    reach.unlink("c", "d")
+    assert not reach.reaches("a", "d")
+    assert reach.descendants["a"] == {"b": 1, "c": 1}
+    assert reach.ancestors["e"] == {"d": 1}
+
+
+def test_reachability_rejects_cycles():
+    reach = ReachabilityIndex()
+    reach.link("a", "b")
+    reach.link("b", "c")
+    assert reach.would_cycle("c", "a")
+    assert reach.would_cycle("b", "b")
+    assert not reach.would_cycle("a", "c")
+    reach.unlink("a", "b")
+    assert not reach.would_cycle("c", "a")
+
+
+def test_model_rejects_circular_nesting():
+    model = Model()
+    (s1, s2, s3) = model.create_shelves(3)
+    (t1, t2) = model.create_tasks(2)
+    assert model.position_task_in_shelf(t1, s1)[0]
+    assert model.position_shelf_in_task(s2, t1)[0]
+    assert model.position_task_in_shelf(t2, s2)[0]
+    assert model.position_shelf_in_task(s3, t2)[0]
+    assert model.position_shelf_in_task(s1, t2) == (False, "Addition would create circular nesting")
+    assert model.position_task_in_shelf(t1, s3) == (False, "Addition would create circular nesting")
+    assert model.get_subshelves(t2) == [s3]
+    assert model.get_subtasks(s3) == []
+    # once the link through s2 is gone, the same nesting is allowed
+    assert model.position_shelf_in_task(s2, t1, 0)[0]
+    assert model.position_task_in_shelf(t1, s3)[0]
+    assert model.nesting.is_below(t1, s2)
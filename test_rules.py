@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from model import Model
+from rules import Filter, RuleError
+
+
+def board_with_values(values):
+    model = Model()
+    model.add_custom_field("value", "spin")
+    tasks = [model.create_empty_task() for _ in values]
+    for (task, value) in zip(tasks, values):
+        if value is not None:
+            model.edit_task(task, value=value)
+    return model, tasks
+
+
+# a numeric field on its own is true when it is set and not zero
+def test_bare_numeric_field():
+    model, tasks = board_with_values([2.0, 0.0, None, -1.5])
+    types = model.rule_types()
+    assert list(Filter("value", types).mask(model.taskdf)) == [True, False, False, True]
+    assert list(Filter("not value", types).mask(model.taskdf)) == [False, True, True, False]
+    assert list(Filter("value and not completed", types).mask(model.taskdf)) == [True, False, False, True]
+
+
+def test_filter_shelf_on_bare_numeric_field():
+    model, tasks = board_with_values([2.0, 0.0, None, -1.5])
+    shelf = model.create_empty_shelf()
+    assert model.edit_shelf(shelf, is_filter=True, filter_string="value") == (True, "")
+    assert model.get_subtasks(shelf) == [tasks[0], tasks[3]]
+    model.edit_task(tasks[1], value=4.0)
+    assert model.get_subtasks(shelf) == [tasks[0], tasks[3], tasks[1]]
+
+
+# seen counts change without rerunning rules, so rules can't read them
+def test_rules_cannot_read_seen():
+    model, tasks = board_with_values([1.0])
+    shelf = model.create_empty_shelf()
+    assert not model.edit_shelf(shelf, is_filter=True, filter_string="seen == 0")[0]
+    assert not model.edit_shelf(shelf, is_sorter=True, sorter_string="seen desc")[0]
+
+
+def labelled_frame():
+    return pd.DataFrame({"label": pd.array(["buy milk", "call bob", None], dtype="string"),
+                         "note": pd.array(["milk", "alice", "a"], dtype="string"),
+                         "due": pd.to_datetime(["2024-01-01", None, "2025-05-05"])}, index=["t1", "t2", "t3"])
+
+
+label_types = {"label": str, "note": str, "due": pd.Timestamp}
+
+
+def test_contains_field_on_right():
+    df = labelled_frame()
+    assert list(Filter("label contains note", label_types).mask(df)) == [True, False, False]
+    assert list(Filter("label contains 'bob'", label_types).mask(df)) == [False, True, False]
+
+
+def test_contains_literal_on_left():
+    df = labelled_frame()
+    assert list(Filter("'buy milk now' contains label", label_types).mask(df)) == [True, False, False]
+    assert list(Filter("5 contains label", label_types).mask(df)) == [False, False, False]
+
+
+def test_dates_compare_with_quoted_dates():
+    df = labelled_frame()
+    assert list(Filter("due > '2024-06-01'", label_types).mask(df)) == [False, False, True]
+    assert list(Filter("'2024-06-01' < due", label_types).mask(df)) == [False, False, True]
+    with pytest.raises(RuleError):
+        Filter("due == 'soon'", label_types)
+
+
+@pytest.mark.parametrize("string", ["due == label", "label == due", "today < label"])
+def test_dates_do_not_compare_with_text_fields(string):
+    with pytest.raises(RuleError):
+        Filter(string, label_types)
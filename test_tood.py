@@ -0,0 +1,210 @@
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from model import Model, convert_tood
+from tood import atomic_write, is_binary_path, read_journal
+
+
+# save a board the way the controller does, appending to its journal when it can
+def save(model, path, journaled=True):
+    if journaled and model.can_journal(path):
+        model.write_journal_entry(path)
+        return
+    snapshot = model.snapshot_for_save()
+    with atomic_write(path) as file:
+        snapshot.write(file, is_binary_path(path))
+    model.snapshot_saved(path, journaled, snapshot.version)
+
+
+def load(path):
+    model = Model()
+    with open(path, "rb") as file:
+        if is_binary_path(path):
+            model.read_from_binary(file)
+        else:
+            model.read_from_file(file)
+    return model
+
+
+def assert_same_board(a, b):
+    assert_frame_equal(a.taskdf, b.taskdf)
+    assert_frame_equal(a.shelfdf, b.shelfdf)
+    assert a.taskfields == b.taskfields
+    assert {s: a.nesting.tasks_in(s) for s in a.shelfdf.index} == {s: b.nesting.tasks_in(s) for s in b.shelfdf.index}
+    assert {t: a.nesting.shelves_in(t) for t in a.taskdf.index} == {t: b.nesting.shelves_in(t) for t in b.taskdf.index}
+    assert a.rack == b.rack
+    assert a.stage == b.stage
+    assert a.labels.high_water == b.labels.high_water
+
+
+def sample_board():
+    model = Model()
+    model.add_custom_field("points", "spin")
+    model.add_custom_field("urgent", "check")
+    tasks = model.create_tasks(6)
+    shelves = model.create_shelves(3)
+    for (i, task) in enumerate(tasks):
+        model.edit_task(task, label="task " + str(i), points=float(i), urgent=i % 2 == 0)
+    for task in tasks[:4]:
+        model.position_task_in_shelf(task, shelves[0])
+    model.position_task_in_shelf(tasks[4], shelves[1])
+    model.position_shelf_in_task(shelves[2], tasks[1])
+    model.position_task_in_shelf(tasks[5], shelves[2])
+    for shelf in shelves[:2]:
+        model.add_shelf_to_rack(shelf)
+    model.replace_task_in_stage(tasks[0])
+    return model, tasks, shelves
+
+
+@pytest.mark.parametrize("name", ["board.tood", "board.toodz"])
+def test_journal_replays_onto_saved_board(tmp_path, monkeypatch, name):
+    # a board this small would be rewritten once its journal outgrew it
+    monkeypatch.setattr(Model, "journal_size_limit", 100)
+    path = str(tmp_path / name)
+    model, tasks, shelves = sample_board()
+    save(model, path)
+
+    model.add_custom_field("due", "date")
+    model.edit_task(tasks[0], due=pd.Timestamp("2024-03-01"))
+    model.edit_tasks({tasks[1]: {"due": "2024-04-15", "label": "renamed"}, tasks[2]: {"points": 9.5}})
+    model.add_custom_field("notes", "text")
+    model.edit_task(tasks[3], notes="first")
+    model.rename_field("notes", "memo")
+    model.position_task_in_shelf(tasks[3], shelves[0], 1)
+    model.position_shelf_in_task(shelves[1], tasks[5])
+    save(model, path)
+
+    (new_task,) = model.create_tasks(1)
+    model.edit_task(new_task, label="added", due="2025-01-01", memo="second")
+    model.position_task_in_shelf(new_task, shelves[2], 1)
+    model.delete_custom_field("urgent")
+    model.erase_task(tasks[2])
+    model.erase_shelf(shelves[1])
+    model.add_shelf_to_rack(shelves[2], 0)
+    model.replace_task_in_stage(new_task)
+    save(model, path)
+
+    assert len(read_journal(path)) == 2
+    loaded = load(path)
+    assert_same_board(model, loaded)
+    assert loaded.taskdf["due"].dtype == "datetime64[ns]"
+    assert loaded.get_subtasks(shelves[2]) == [new_task, tasks[5]]
+
+
+# every kind of field, with values missing from some of them
+def board_with_gaps():
+    model, tasks, shelves = sample_board()
+    model.add_custom_field("due", "date")
+    model.add_custom_field("notes", "text")
+    model.edit_task(tasks[1], due="2024-04-15", notes="call back")
+    model.edit_task(tasks[2], points=None, urgent=None)
+    model.edit_shelf(shelves[1], is_sorter=True, sorter_string="points desc")
+    return model
+
+
+def test_xml_round_trip(tmp_path):
+    model = board_with_gaps()
+    first = str(tmp_path / "first.tood")
+    second = str(tmp_path / "second.tood")
+    save(model, first, journaled=False)
+    loaded = load(first)
+    assert_same_board(model, loaded)
+    save(loaded, second, journaled=False)
+    with open(first, "rb") as a, open(second, "rb") as b:
+        assert a.read() == b.read()
+
+
+# boards saved before the nesting section was versioned hold a row per shelf with a column per task,
+# where positive positions are tasks in the shelf and negative positions are the shelf in tasks
+legacy_board = """<?xml version='1.0' encoding='utf-8'?>
+<data>
+<shelves>
+  <shelf index="s1" title="inbox" seen="1" is_filter="False" filter_string="" is_sorter="False" sorter_string=""/>
+  <shelf index="s2" title="later" seen="1" is_filter="False" filter_string="" is_sorter="False" sorter_string=""/>
+</shelves>
+<fields>
+  <field>due gadget=date</field>
+</fields>
+<tasks>
+  <task index="t1" label="first" seen="1" completed="False" due="2024-03-01"/>
+  <task index="t2" label="second" seen="2" completed="True"/>
+  <task index="t3" label="third" seen="0" completed="False"/>
+</tasks>
+<nesting>
+  <shelf index="s1" t1="2.0" t2="1.0" t3="0.0"/>
+  <shelf index="s2" t1="-1.0" t2="1.0" t3=""/>
+</nesting>
+<rack>
+  <shelf>s1</shelf>
+</rack>
+<stage/>
+</data>
+"""
+
+
+def test_legacy_nesting_is_read(tmp_path):
+    path = tmp_path / "legacy.tood"
+    path.write_text(legacy_board, encoding="utf-8")
+    model = load(str(path))
+    assert model.get_subtasks("s1") == ["t2", "t1"]
+    assert model.get_subtasks("s2") == ["t2"]
+    assert model.get_subshelves("t1") == ["s2"]
+    assert model.get_subshelves("t2") == []
+    assert list(model.taskdf["seen"]) == [1, 2, 0]
+    assert list(model.taskdf["completed"]) == [False, True, False]
+    assert model.taskdf.at["t1", "due"] == pd.Timestamp("2024-03-01")
+    assert model.labels.high_water == {"t": 3, "s": 2}
+    assert model.rack == ["s1"]
+    assert model.stage is None
+    # saving it again writes the list of links, which reads back as the same board
+    save(model, str(path), journaled=False)
+    assert "<nesting version=\"2\">" in path.read_text(encoding="utf-8")
+    assert_same_board(model, load(str(path)))
+
+
+def test_binary_round_trip(tmp_path):
+    model = board_with_gaps()
+    xml = str(tmp_path / "board.tood")
+    binary = str(tmp_path / "board.toodz")
+    back = str(tmp_path / "back.tood")
+    save(model, xml, journaled=False)
+    convert_tood(xml, binary)
+    loaded = load(binary)
+    assert_same_board(model, loaded)
+    assert dict(loaded.taskdf.dtypes) == dict(model.taskdf.dtypes)
+    assert dict(loaded.shelfdf.dtypes) == dict(model.shelfdf.dtypes)
+    convert_tood(binary, back)
+    with open(xml, "rb") as a, open(back, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_failed_write_leaves_board_intact(tmp_path):
+    path = tmp_path / "board.tood"
+    path.write_bytes(b"saved before")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as file:
+            file.write(b"partly written")
+            raise RuntimeError("disk full")
+    assert path.read_bytes() == b"saved before"
+    assert [p.name for p in tmp_path.iterdir()] == ["board.tood"]
+
+
+def test_failed_save_keeps_changes_unsaved(tmp_path):
+    path = str(tmp_path / "board.tood")
+    model, tasks, shelves = sample_board()
+    save(model, path, journaled=False)
+    model.edit_task(tasks[0], label="changed")
+
+    def fail(done, total):
+        raise RuntimeError("disk full")
+
+    snapshot = model.snapshot_for_save()
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as file:
+            snapshot.write(file, False, fail)
+    model.snapshot_not_saved()
+    assert load(path).taskdf.at[tasks[0], "label"] == "task 0"
+    assert model.changes_since_save() > 0
+    save(model, path, journaled=False)
+    assert load(path).taskdf.at[tasks[0], "label"] == "changed"
@@ -0,0 +1,458 @@
+import json
+import os
+import secrets
+import zlib
+from contextlib import contextmanager
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+# version of the nesting section written to new files
+# 1: one element per shelf with an attribute per linked task, positive for its tasks and negative for its supertasks
+# 2: one element per shelf or task that holds anything, listing the ids it holds in order
+nesting_version = "2"
+
+# boards saved with this extension are written in the binary columnar format instead of xml
+binary_extension = ".toodz"
+# version of the binary format written to new files
+binary_version = "1"
+# numpy type each nullable column dtype is stored as, and the value stored in place of missing ones
+# the missing values themselves are kept in a mask next to each column
+# string columns are stored as one utf-8 buffer and the offsets of each value in it
+binary_value_types = {
+    "Float64": ("float64", 0.0),
+    "Int32": ("int32", 0),
+    "boolean": ("bool", False),
+    "datetime64[ns]": ("datetime64[ns]", np.datetime64("NaT", "ns")),
+}
+
+
+class ToodContents:
+    # everything read from a .tood file, in plain python structures that the model builds itself from
+
+    def __init__(self):
+        # sections found in the file and the version of each
+        self.sections = {}
+        # attributes of each shelf and task element, including their index
+        self.shelves = []
+        self.tasks = []
+        # typed dataframes, read directly by the binary reader in place of the attributes above
+        self.shelfdf = None
+        self.taskdf = None
+        # custom task fields and their gadgets
+        self.fields = {}
+        # (position, task) pairs in each shelf and (position, shelf) pairs in each task
+        self.shelf_tasks = {}
+        self.task_shelves = {}
+        self.rack = []
+        self.stage = None
+        # label high-water marks by prefix
+        self.labels = {}
+
+
+# journals are kept next to the board they belong to, with this added to its path
+journal_suffix = ".journal"
+# rows of a dataframe written at a time, between progress reports
+rows_per_report = 5000
+# elements read from a file at a time, between progress reports
+elements_per_report = 10000
+
+
+# raised by a progress report to stop reading or writing a board part way
+class Cancelled(Exception):
+    pass
+
+
+class BoardSnapshot:
+    # everything written to a .tood file, taken from a model at one moment
+    # everything in it is copied, so the model can change while this is written on another thread
+
+    def __init__(self, shelfdf, taskdf, fields, shelf_tasks, task_shelves, rack, stage, labels, version):
+        self.shelfdf = shelfdf
+        self.taskdf = taskdf
+        self.fields = fields
+        # ordered children of every shelf and task that holds anything
+        self.shelf_tasks = shelf_tasks
+        self.task_shelves = task_shelves
+        self.rack = rack
+        self.stage = stage
+        # label high-water marks by prefix
+        self.labels = labels
+        # version of the model it was taken from
+        self.version = version
+
+    # write the board to a file in the binary or xml format
+    # progress is called with the amount written so far and the total, and can raise Cancelled
+    def write(self, file, binary, progress=None):
+        if binary:
+            write_binary(file, self, progress)
+        else:
+            write_tood(file, self, progress)
+
+
+# read a .tood file in one pass, handing each element to the reader for its section as soon as it is complete
+# elements are dropped once read, so memory is bounded by the contents rather than the document
+# progress is called with the number of bytes read so far and the size of the file, and can raise Cancelled
+def read_tood(path, progress=None):
+    contents = ToodContents()
+    depth = 0
+    section = None
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        for (i, (event, elem)) in enumerate(ET.iterparse(file, events=("start", "end"))):
+            if progress is not None and i % elements_per_report == 0:
+                progress(file.tell(), size)
+            if event == "start":
+                depth += 1
+                if depth == 2:
+                    section = elem
+                    contents.sections[elem.tag] = elem.get("version", "1")
+                continue
+
+            depth -= 1
+            if depth == 2:
+                reader = section_readers.get((section.tag, contents.sections[section.tag]))
+                if reader is not None:
+                    reader(contents, elem)
+                # forget elements already read
+                section.clear()
+            elif depth == 1:
+                section.clear()
+                section = None
+    return contents
+
+
+def read_shelf(contents, elem):
+    contents.shelves.append(dict(elem.attrib))
+
+
+def read_task(contents, elem):
+    contents.tasks.append(dict(elem.attrib))
+
+
+# fields are written as "label gadget=type"
+def read_field(contents, elem):
+    label, gadget = elem.text.strip().split(" gadget=")
+    contents.fields[label] = gadget
+
+
+# version 1 nesting: one element per shelf with an attribute per linked task
+# positive positions are tasks in the shelf and negative positions are the shelf in tasks
+def read_nesting_row(contents, elem):
+    shelf = elem.get("index")
+    for (task, value) in elem.attrib.items():
+        if task == "index" or value == "":
+            continue
+        pos = int(float(value))
+        if pos > 0:
+            contents.shelf_tasks.setdefault(shelf, []).append((pos, task))
+        elif pos < 0:
+            contents.task_shelves.setdefault(task, []).append((-pos, shelf))
+
+
+# version 2 nesting: <shelf id="s1">t2 t5</shelf> lists the tasks in a shelf
+# and <task id="t2">s3</task> lists the shelves in a task, each in order
+def read_nesting_links(contents, elem):
+    links = contents.shelf_tasks if elem.tag == "shelf" else contents.task_shelves
+    links[elem.get("id")] = list(enumerate((elem.text or "").split(), start=1))
+
+
+# write a board snapshot as xml, in the sections read_tood reads
+# progress is called with the number of rows written so far and the total, and can raise Cancelled
+def write_tood(file, board, progress=None):
+    total = len(board.shelfdf.index) + len(board.taskdf.index) + 1
+
+    # write header
+    file.write(bytes("<?xml version='1.0' encoding='utf-8'?>\n", 'utf-8'))
+    file.write(bytes("<data>\n", 'utf-8'))
+    # write shelfdf
+    write_rows(file, board.shelfdf, "shelves", "shelf", progress, 0, total)
+    # write taskfields
+    if len(board.fields) > 0:
+        file.write(bytes("<fields>\n", 'utf-8'))
+        for (k, v) in board.fields.items():
+            file.write(bytes("  <field>" + k + " gadget=" + v + "</field>\n", 'utf-8'))
+        file.write(bytes("</fields>\n", 'utf-8'))
+    else:
+        file.write(bytes("<fields/>\n", 'utf-8'))
+    # write taskdf
+    write_rows(file, board.taskdf, "tasks", "task", progress, len(board.shelfdf.index), total)
+    # write nesting as a list of links
+    write_nesting(file, board)
+    # write rack
+    if len(board.rack) > 0:
+        file.write(bytes("<rack>\n", 'utf-8'))
+        for x in board.rack:
+            file.write(bytes("  <shelf>"+x+"</shelf>\n", 'utf-8'))
+        file.write(bytes("</rack>\n", 'utf-8'))
+    else:
+        file.write(bytes("<rack/>\n", 'utf-8'))
+    # write stage
+    if board.stage is not None:
+        file.write(bytes("<stage>\n", 'utf-8'))
+        file.write(bytes("  <task>"+board.stage+"</task>\n", 'utf-8'))
+        file.write(bytes("</stage>\n", 'utf-8'))
+    else:
+        file.write(bytes("<stage/>\n", 'utf-8'))
+    # write label high-water marks
+    file.write(bytes("<labels>\n", 'utf-8'))
+    for (k, v) in board.labels.items():
+        file.write(bytes("  <label prefix=\"" + k + "\">" + str(v) + "</label>\n", 'utf-8'))
+    file.write(bytes("</labels>\n", 'utf-8'))
+    file.write(bytes("</data>\n", 'utf-8'))
+    if progress is not None:
+        progress(total, total)
+
+
+# write the rows of a dataframe as one section with an element per row, a few thousand rows at a time
+def write_rows(file, df, root_name, row_name, progress, done, total):
+    if len(df.index) == 0:
+        file.write(bytes("<" + root_name + "/>\n", 'utf-8'))
+        return
+    file.write(bytes("<" + root_name + ">\n", 'utf-8'))
+    for start in range(0, len(df.index), rows_per_report):
+        text = df.iloc[start:start + rows_per_report].to_xml(attr_cols=df.columns.tolist(), root_name=root_name,
+                                                             row_name=row_name, xml_declaration=False)
+        # keep the rows without the section element around them
+        file.write(bytes(text[text.index("\n") + 1:text.rindex("</" + root_name + ">")], 'utf-8'))
+        if progress is not None:
+            progress(done + min(start + rows_per_report, len(df.index)), total)
+    file.write(bytes("</" + root_name + ">\n", 'utf-8'))
+
+
+# write the nesting section as the ordered links of every shelf and task holding anything
+# its size grows with the number of links rather than with shelves times tasks
+def write_nesting(file, board):
+    lines = ["<nesting version=\"" + nesting_version + "\">\n"]
+    for (tag, children) in [("shelf", board.shelf_tasks), ("task", board.task_shelves)]:
+        lines.extend("  <" + tag + " id=\"" + c + "\">" + " ".join(items) + "</" + tag + ">\n"
+                     for (c, items) in children.items())
+    lines.append("</nesting>\n")
+    file.write(bytes("".join(lines), 'utf-8'))
+
+
+def read_rack_shelf(contents, elem):
+    contents.rack.append(elem.text.strip())
+
+
+def read_stage_task(contents, elem):
+    contents.stage = elem.text.strip()
+
+
+def read_label(contents, elem):
+    contents.labels[elem.get("prefix")] = int(elem.text)
+
+
+# reader for the elements inside each section, by section name and version
+section_readers = {
+    ("shelves", "1"): read_shelf,
+    ("tasks", "1"): read_task,
+    ("fields", "1"): read_field,
+    ("nesting", "1"): read_nesting_row,
+    ("nesting", "2"): read_nesting_links,
+    ("rack", "1"): read_rack_shelf,
+    ("stage", "1"): read_stage_task,
+    ("labels", "1"): read_label,
+}
+
+
+# whether a board path is saved in the binary format
+def is_binary_path(path):
+    return path.lower().endswith(binary_extension)
+
+
+# write a board as a bundle of numpy arrays, one or two per column, with no per-value text conversion
+# everything else the xml file holds is kept, so a board converts between the two formats without loss
+# progress is called with the number of steps done so far and the total, and can raise Cancelled
+def write_binary(file, board, progress=None):
+    arrays = {"version": np.array([binary_version])}
+    put_frame(arrays, "shelves", board.shelfdf)
+    put_frame(arrays, "tasks", board.taskdf)
+    if progress is not None:
+        progress(1, 3)
+    for (name, held) in [("shelf_tasks", board.shelf_tasks), ("task_shelves", board.task_shelves)]:
+        put_strings(arrays, name + ":holders", list(held))
+        arrays[name + ":counts"] = np.array([len(items) for items in held.values()], dtype="int64")
+        put_strings(arrays, name + ":items", [x for items in held.values() for x in items])
+    put_strings(arrays, "rack", board.rack)
+    put_strings(arrays, "stage", [] if board.stage is None else [board.stage])
+    arrays["meta"] = np.array([json.dumps({"fields": board.fields, "labels": board.labels})])
+    if progress is not None:
+        progress(2, 3)
+    np.savez(file, **arrays)
+    if progress is not None:
+        progress(3, 3)
+
+
+# read a board written by write_binary into the same contents as read_tood, with typed dataframes
+# progress is called with the number of steps done so far and the total, and can raise Cancelled
+def read_binary(path, progress=None):
+    contents = ToodContents()
+    with np.load(path, allow_pickle=False) as arrays:
+        contents.sections["binary"] = str(arrays["version"][0])
+        contents.shelfdf = get_frame(arrays, "shelves")
+        contents.taskdf = get_frame(arrays, "tasks")
+        if progress is not None:
+            progress(1, 2)
+        for (name, links) in [("shelf_tasks", contents.shelf_tasks), ("task_shelves", contents.task_shelves)]:
+            items = get_strings(arrays, name + ":items")
+            start = 0
+            for (holder, count) in zip(get_strings(arrays, name + ":holders"), arrays[name + ":counts"].tolist()):
+                links[holder] = list(enumerate(items[start:start + count], start=1))
+                start += count
+        contents.rack = get_strings(arrays, "rack")
+        stage = get_strings(arrays, "stage")
+        contents.stage = stage[0] if len(stage) > 0 else None
+        meta = json.loads(str(arrays["meta"][0]))
+    contents.fields = meta["fields"]
+    contents.labels = meta["labels"]
+    if progress is not None:
+        progress(2, 2)
+    return contents
+
+
+# store a list of strings as one utf-8 buffer and the offset where each string ends
+def put_strings(arrays, key, strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    arrays[key + ":data"] = np.frombuffer(b"".join(encoded), dtype="uint8")
+    arrays[key + ":ends"] = np.cumsum([len(b) for b in encoded], dtype="int64")
+
+
+def get_strings(arrays, key):
+    data = arrays[key + ":data"].tobytes()
+    ends = arrays[key + ":ends"].tolist()
+    return [data[start:end].decode("utf-8") for (start, end) in zip([0] + ends, ends)]
+
+
+# store each column of a typed dataframe as its values and a mask of the missing ones
+def put_frame(arrays, key, df):
+    put_strings(arrays, key + ":index", df.index.tolist())
+    put_strings(arrays, key + ":columns", df.columns.tolist())
+    put_strings(arrays, key + ":dtypes", [str(df[col].dtype) for col in df.columns])
+    for (i, col) in enumerate(df.columns):
+        values = df[col]
+        name = key + ":" + str(i)
+        arrays[name + ":mask"] = values.isna().to_numpy()
+        dtype = str(values.dtype)
+        if dtype in binary_value_types:
+            (value_type, fill) = binary_value_types[dtype]
+            arrays[name] = values.to_numpy(dtype=value_type, na_value=fill)
+        else:
+            put_strings(arrays, name, values.astype("string").fillna("").tolist())
+
+
+def get_frame(arrays, key):
+    index = pd.Index(get_strings(arrays, key + ":index"))
+    columns = {}
+    dtypes = get_strings(arrays, key + ":dtypes")
+    for (i, (col, dtype)) in enumerate(zip(get_strings(arrays, key + ":columns"), dtypes)):
+        name = key + ":" + str(i)
+        mask = arrays[name + ":mask"]
+        if dtype == "Float64":
+            values = pd.arrays.FloatingArray(arrays[name], mask)
+        elif dtype == "Int32":
+            values = pd.arrays.IntegerArray(arrays[name], mask)
+        elif dtype == "boolean":
+            values = pd.arrays.BooleanArray(arrays[name], mask)
+        elif dtype == "datetime64[ns]":
+            values = np.where(mask, np.datetime64("NaT", "ns"), arrays[name])
+        else:
+            strings = get_strings(arrays, name)
+            values = pd.array([None if m else s for (s, m) in zip(strings, mask.tolist())], dtype=dtype)
+        columns[col] = pd.Series(values, index=index)
+    return pd.DataFrame(columns, index=index)
+
+
+# a journal is a header line naming the snapshot it belongs to, followed by one json entry per journaled save
+# each entry holds the changes made to the board since the save before it
+def journal_path(path):
+    return path + journal_suffix
+
+
+# checksum of a whole file, read in blocks
+def file_checksum(path):
+    checksum = 0
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            checksum = zlib.crc32(block, checksum)
+    return checksum
+
+
+# begin an empty journal for a snapshot that was just written, replacing any older one
+def start_journal(path):
+    with atomic_write(journal_path(path)) as file:
+        file.write(bytes(json.dumps({"snapshot": file_checksum(path)}) + "\n", 'utf-8'))
+
+
+# entries are on disk once this returns, and one cut short by a crash is dropped when the journal is read
+def append_journal(path, entry):
+    with open(journal_path(path), "a", encoding="utf-8") as file:
+        file.write(json.dumps(entry, default=str) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def discard_journal(path):
+    if os.path.exists(journal_path(path)):
+        os.remove(journal_path(path))
+
+
+def journal_size(path):
+    return os.path.getsize(journal_path(path))
+
+
+# entries of the journal of a board, or None if it has none or its journal belongs to another snapshot
+# an entry cut short by a crash while it was written is left out
+def read_journal(path):
+    if not os.path.exists(journal_path(path)):
+        return None
+    with open(journal_path(path), "r", encoding="utf-8") as file:
+        lines = file.read().splitlines()
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        return None
+    if header.get("snapshot") != file_checksum(path):
+        return None
+    entries = []
+    for line in lines[1:]:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            break
+    return entries
+
+
+# open a file to be written in place of path, which is only replaced once everything is written and on disk
+# a crash or error before then leaves the previous file as it was, and no partly written one in its place
+@contextmanager
+def atomic_write(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    # hidden file in the same directory, so the rename can't cross file systems
+    temp = os.path.join(directory, "." + os.path.basename(path) + "." + secrets.token_hex(4) + ".tmp")
+    try:
+        with open(temp, "xb") as file:
+            if os.path.exists(path):
+                os.chmod(temp, os.stat(path).st_mode)
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    sync_directory(directory)
+
+
+# make a rename in a directory durable
+# directories can't be opened on windows, where renames are already durable once the file is flushed
+def sync_directory(directory):
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,8 +1,10 @@
-from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QEvent, QDateTime, QDir, QSize, QTime
-from PyQt5.QtGui import QDrag, QPixmap
+from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QEvent, QDateTime, QDir, QSize, QTime, QRect, \
+    QAbstractListModel, QModelIndex, QPersistentModelIndex
+from PyQt5.QtGui import QDrag, QPixmap, QPainter, QColor
 from PyQt5.QtWidgets import QMainWindow, QPushButton, QScrollArea, QHBoxLayout, QWidget, QFrame, \
     QVBoxLayout, QStackedWidget, QLabel, QLineEdit, QCheckBox, QGroupBox, QGridLayout, QMessageBox, \
-    QDoubleSpinBox, QDateTimeEdit, QFileDialog, QSizePolicy, QApplication, QComboBox
+    QDoubleSpinBox, QDateTimeEdit, QFileDialog, QSizePolicy, QApplication, QComboBox, QProgressDialog, \
+    QListView, QStyledItemDelegate, QAbstractItemView, QStyle
 import math
 
 class View(QMainWindow):
@@ -12,6 +14,12 @@ class View(QMainWindow):
         super(QMainWindow, self).__init__()
 
         self.controller = controller
+        # progress of the save or load running in the background, if any
+        self.progress = None
+        # progress of building the widgets of a loaded board, if they are still being built
+        self.build_progress = None
+        # task and shelf widgets on the board, by if they are tasks and their id
+        self.instances = {}
 
         # create UI
         self.setWindowTitle("TOOD")
@@ -64,9 +72,9 @@ class View(QMainWindow):
         new_shelf_button.pressed.connect(self.controller.new_shelf_in_rack)
         self.clicked_out_of_edit.connect(self.controller.widget_edit_ended)
         load_tood_button.pressed.connect(lambda: self.controller.load_tood(
-            QFileDialog.getOpenFileName(self, "Open File", QDir.homePath(), "TOOD file (*.tood)")[0]))
+            QFileDialog.getOpenFileName(self, "Open File", QDir.homePath(), "TOOD file (*.tood *.toodz)")[0]))
         save_tood_button.pressed.connect(lambda: self.controller.save_tood(
-            QFileDialog.getSaveFileName(self, "Save File", QDir.homePath(), "TOOD file (*.tood)")[0]))
+            QFileDialog.getSaveFileName(self, "Save File", QDir.homePath(), "TOOD file (*.tood *.toodz)")[0]))
 
     # methods to detect clicking out of selected widget
     def process_click_during_edit(self, pos):
@@ -100,6 +108,74 @@ class View(QMainWindow):
     def show_warning(self, text):
         QMessageBox.warning(self, "Warning", text)
 
+    # show the progress of a background save or load, with a button to cancel it
+    # it only appears if the job takes more than a moment
+    def show_progress(self, job, modal):
+        self.progress = QProgressDialog("", "Cancel", 0, 100, self)
+        self.progress.setWindowModality(Qt.WindowModal if modal else Qt.NonModal)
+        self.progress.setMinimumDuration(500)
+        self.progress.setAutoReset(False)
+        self.progress.setValue(0)
+        job.progressed.connect(self.update_progress)
+        self.progress.canceled.connect(self.controller.cancel_job)
+
+    def update_progress(self, step, percent):
+        if self.progress is not None:
+            self.progress.setLabelText(step)
+            self.progress.setValue(percent)
+
+    def hide_progress(self):
+        self.progress.canceled.disconnect()
+        self.progress.close()
+        self.progress.deleteLater()
+        self.progress = None
+
+    # show the progress of building the widgets of a loaded board, which carries on while the board is used
+    def show_build_progress(self):
+        self.build_progress = QProgressDialog("Building board", None, 0, 100, self)
+        self.build_progress.setWindowModality(Qt.NonModal)
+        self.build_progress.setMinimumDuration(500)
+        self.build_progress.setAutoReset(False)
+        self.build_progress.setValue(0)
+
+    def update_build_progress(self, percent):
+        self.build_progress.setValue(percent)
+
+    def hide_build_progress(self):
+        self.build_progress.close()
+        self.build_progress.deleteLater()
+        self.build_progress = None
+
+    # returns the widgets on the board showing the given task or shelf
+    def get_instances(self, df_id, is_id_task):
+        return list(self.instances.get((is_id_task, df_id), ()))
+
+    # record a widget and everything nested in it as being on the board
+    def register_tree(self, widget):
+        to_visit = [widget]
+        while len(to_visit) != 0:
+            w = to_visit.pop()
+            w.live = True
+            self.instances.setdefault((isinstance(w, Task), w.df_id), {})[w] = None
+            to_visit.extend(w.get_children())
+            # virtual shelves only have a task widget for their open row
+            if isinstance(w, Shelf) and w.open_task() is not None:
+                to_visit.append(w.open_task())
+
+    # forget a widget and everything nested in it once it is taken off the board
+    def unregister_tree(self, widget):
+        to_visit = [widget]
+        while len(to_visit) != 0:
+            w = to_visit.pop()
+            w.live = False
+            key = (isinstance(w, Task), w.df_id)
+            del self.instances[key][w]
+            if len(self.instances[key]) == 0:
+                del self.instances[key]
+            to_visit.extend(w.get_children())
+            if isinstance(w, Shelf) and w.open_task() is not None:
+                to_visit.append(w.open_task())
+
 
 class Task(QFrame):
 
@@ -108,6 +184,13 @@ class Task(QFrame):
         self.view = view
         self.owner = owner
         self.df_id = df_id
+        # if the widget is on the board, under the rack or stage
+        self.live = False
+        # if the child widgets are built, and how many children there are while they aren't
+        self.built = True
+        self.unbuilt_count = 0
+        # counts down to tearing down the child widgets once the tree is collapsed, if that is enabled
+        self.teardown_timer = None
         self.setObjectName("Task" + str(self.df_id))
 
         # added padding when going from lower level up to this one
@@ -196,6 +279,8 @@ class Task(QFrame):
 
         # update width when tree collapsed
         self.collapse_tree.collapse_toggled.connect(self.check_width)
+        # build or schedule tearing down child widgets when tree opened or collapsed
+        self.collapse_tree.collapse_toggled.connect(lambda opened: self.view.controller.tree_toggled(self, opened))
 
         # connect inputs to controller
         new_shelf_button.pressed.connect(lambda: self.view.controller.new_shelf_in_task(self))
@@ -298,6 +383,8 @@ class Task(QFrame):
     def add_child(self, child):
         child.set_owner(self)
         self.container_layout.addWidget(child)
+        if self.live:
+            self.view.register_tree(child)
         if self.container_layout.count() == 1:
             self.child_indicator.setFrameShape(QFrame.Box)
         self.check_width()
@@ -305,11 +392,15 @@ class Task(QFrame):
     def insert_child(self, child, pos):
         child.set_owner(self)
         self.container_layout.insertWidget(pos, child)
+        if self.live:
+            self.view.register_tree(child)
         if self.container_layout.count() == 1:
             self.child_indicator.setFrameShape(QFrame.Box)
         self.check_width()
 
     def remove_child(self, child):
+        if child.live:
+            self.view.unregister_tree(child)
         child.set_owner(None)
         self.container_layout.removeWidget(child)
         child.setParent(None)
@@ -317,12 +408,45 @@ class Task(QFrame):
             self.child_indicator.setFrameShape(QFrame.NoFrame)
         self.check_width()
 
+    # move a child to another position, keeping its widget and everything nested in it
+    def move_child(self, child, pos):
+        self.container_layout.removeWidget(child)
+        self.container_layout.insertWidget(pos, child)
+
     def get_child(self, idx):
         return self.container_layout.itemAt(idx).widget()
 
     def get_children(self):
         return [self.container_layout.itemAt(i).widget() for i in range(self.container_layout.count())]
 
+    # number of children, whether or not their widgets are built
+    def count_children(self):
+        return self.container_layout.count() if self.built else self.unbuilt_count
+
+    # leave the children without widgets, only showing if there are any, until the tree is opened
+    def set_unbuilt(self, count):
+        self.built = False
+        self.unbuilt_count = count
+        self.child_indicator.setFrameShape(QFrame.Box if count != 0 else QFrame.NoFrame)
+
+    # make the given widgets the children in order, keeping ones already here and detaching the rest
+    def set_children(self, children):
+        kept = set(children)
+        for w in self.get_children():
+            self.container_layout.removeWidget(w)
+            if w not in kept:
+                if w.live:
+                    self.view.unregister_tree(w)
+                w.set_owner(None)
+                w.setParent(None)
+        for w in children:
+            w.set_owner(self)
+            self.container_layout.addWidget(w)
+            if self.live and not w.live:
+                self.view.register_tree(w)
+        self.child_indicator.setFrameShape(QFrame.Box if len(children) != 0 else QFrame.NoFrame)
+        self.check_width()
+
     def mousePressEvent(self, e):
         b = e.buttons()
         if b == Qt.LeftButton or b == Qt.RightButton or b == Qt.MiddleButton:
@@ -348,7 +472,11 @@ class Task(QFrame):
         if (e.pos() - self.dragStartPosition).manhattanLength() < QApplication.startDragDistance() * 6:
             return
 
-        # handle drag
+        self.drag(b)
+
+    # drag this task with the given mouse button
+    # a position in its shelf can be given for tasks that aren't laid out in their shelf
+    def drag(self, b, position=None):
         drag = QDrag(self)
 
         # have image of this task follow the cursor
@@ -375,8 +503,9 @@ class Task(QFrame):
             drag.exec_(Qt.LinkAction)
         # move the reference to this task
         elif b == Qt.LeftButton:
-            self.undo = (b, self.owner,
-                         self.owner.container_layout.indexOf(self)+1 if isinstance(self.owner, Shelf) else 0)
+            if position is None:
+                position = self.owner.container_layout.indexOf(self)+1 if isinstance(self.owner, Shelf) else 0
+            self.undo = (b, self.owner, position)
             self.view.controller.task_removed(self)
 
             mime = QMimeData()
@@ -428,7 +557,7 @@ class Task(QFrame):
                     break
             # handle case where no location is found
             if not added:
-                self.view.controller.insert_shelf_id_in_task(shelf_id, self, self.container_layout.count()+1)
+                self.view.controller.insert_shelf_id_in_task(shelf_id, self, self.count_children()+1)
             e.accept()
 
     class TaskFieldGroup(QGroupBox):
@@ -559,6 +688,15 @@ class Shelf(QFrame):
         self.view = view
         self.owner = owner
         self.df_id = df_id
+        # if the widget is on the board, under the rack or stage
+        self.live = False
+        # if the child widgets are built, and how many children there are while they aren't
+        self.built = True
+        self.unbuilt_count = 0
+        # counts down to tearing down the child widgets once the tree is collapsed, if that is enabled
+        self.teardown_timer = None
+        # list of painted task rows shown instead of task widgets when the shelf is virtual
+        self.task_list = None
         self.setObjectName("Shelf" + str(self.df_id))
 
         # added padding when going from lower level up to this one
@@ -652,6 +790,8 @@ class Shelf(QFrame):
                                                     Qt.Alignment() if opened else Qt.AlignTop))
         # update width when tree collapsed
         self.collapse_tree.collapse_toggled.connect(self.check_width)
+        # build or schedule tearing down child widgets when tree opened or collapsed
+        self.collapse_tree.collapse_toggled.connect(lambda opened: self.view.controller.tree_toggled(self, opened))
 
         # connect inputs to controller
         new_task_button.pressed.connect(lambda: self.view.controller.new_task_in_shelf(self))
@@ -749,6 +889,8 @@ class Shelf(QFrame):
     def add_child(self, child):
         child.set_owner(self)
         self.container_layout.addWidget(child)
+        if self.live:
+            self.view.register_tree(child)
         if self.container_layout.count() == 1:
             self.child_indicator.setFrameShape(QFrame.Box)
         self.check_width()
@@ -756,11 +898,15 @@ class Shelf(QFrame):
     def insert_child(self, child, pos):
         child.set_owner(self)
         self.container_layout.insertWidget(pos, child)
+        if self.live:
+            self.view.register_tree(child)
         if self.container_layout.count() == 1:
             self.child_indicator.setFrameShape(QFrame.Box)
         self.check_width()
 
     def remove_child(self, child):
+        if child.live:
+            self.view.unregister_tree(child)
         child.set_owner(None)
         self.container_layout.removeWidget(child)
         child.setParent(None)
@@ -768,12 +914,78 @@ class Shelf(QFrame):
             self.child_indicator.setFrameShape(QFrame.NoFrame)
         self.check_width()
 
+    # move a child to another position, keeping its widget and everything nested in it
+    def move_child(self, child, pos):
+        self.container_layout.removeWidget(child)
+        self.container_layout.insertWidget(pos, child)
+
     def get_child(self, idx):
         return self.container_layout.itemAt(idx).widget()
 
     def get_children(self):
         return [self.container_layout.itemAt(i).widget() for i in range(self.container_layout.count())]
 
+    # number of children, whether or not their widgets are built
+    def count_children(self):
+        return self.container_layout.count() if self.built else self.unbuilt_count
+
+    # leave the children without widgets, only showing if there are any, until the tree is opened
+    def set_unbuilt(self, count):
+        self.built = False
+        self.unbuilt_count = count
+        self.child_indicator.setFrameShape(QFrame.Box if count != 0 else QFrame.NoFrame)
+        if self.task_list is not None:
+            self.task_list.model().refresh()
+
+    # show the tasks as rows painted from a list model instead of task widgets
+    def set_virtual(self, tasks):
+        if self.task_list is not None:
+            return
+        self.task_list = TaskList(self.view, self, tasks)
+        shown = self.scroll if self.collapse_tree.contains_widget(self.scroll) else self.container
+        self.collapse_tree.replace_widget(shown, self.task_list)
+
+    # the task widget of the open row of a virtual shelf, if there is one
+    def open_task(self):
+        return self.task_list.editor if self.task_list is not None else None
+
+    # make the given widgets the children in order, keeping ones already here and detaching the rest
+    def set_children(self, children):
+        kept = set(children)
+        for w in self.get_children():
+            self.container_layout.removeWidget(w)
+            if w not in kept:
+                if w.live:
+                    self.view.unregister_tree(w)
+                w.set_owner(None)
+                w.setParent(None)
+        for w in children:
+            w.set_owner(self)
+            self.container_layout.addWidget(w)
+            if self.live and not w.live:
+                self.view.register_tree(w)
+        self.child_indicator.setFrameShape(QFrame.Box if len(children) != 0 else QFrame.NoFrame)
+        self.check_width()
+
+    # rearrange existing child widgets to match a list of task ids without rebuilding them
+    def reorder_children(self, df_ids):
+        by_id = {w.df_id: w for w in self.get_children()}
+        for w in by_id.values():
+            self.container_layout.removeWidget(w)
+        for d in df_ids:
+            self.container_layout.addWidget(by_id[d])
+
+    # add widgets after the current children, resizing once for all of them
+    def extend_children(self, children):
+        for w in children:
+            w.set_owner(self)
+            self.container_layout.addWidget(w)
+            if self.live:
+                self.view.register_tree(w)
+        if self.container_layout.count() != 0:
+            self.child_indicator.setFrameShape(QFrame.Box)
+        self.check_width()
+
     def mousePressEvent(self, e):
         b = e.buttons()
         if b == Qt.LeftButton or b == Qt.RightButton or b == Qt.MiddleButton:
@@ -865,6 +1077,12 @@ class Shelf(QFrame):
                 widget.undo_drag()
         # place the dropped task
         else:
+            # virtual shelves place it at the row it was dropped on
+            if self.task_list is not None:
+                row = self.task_list.indexAt(self.task_list.viewport().mapFrom(self, pos)).row()
+                if row >= 0:
+                    self.view.controller.insert_task_id_in_shelf(task_id, self, row+1)
+                    added = True
             # check each subtask position to find index
             for n in range(self.container_layout.count()):
                 w = self.container_layout.itemAt(n).widget()
@@ -877,11 +1095,192 @@ class Shelf(QFrame):
                     break
             # handle case where no location is found
             if not added:
-                self.view.controller.insert_task_id_in_shelf(task_id, self, self.container_layout.count()+1)
+                self.view.controller.insert_task_id_in_shelf(task_id, self, self.count_children()+1)
             e.accept()
 
 
+class ShelfTasks(QAbstractListModel):
+    # list model of the tasks in a shelf, for shelves with too many tasks to hold a widget for each
+
+    id_role = Qt.UserRole
+    info_role = Qt.UserRole + 1
+    # rows whose task info is read together when a row without it is shown
+    page_size = 64
+
+    def __init__(self, model, shelf):
+        super().__init__()
+        self.model = model
+        self.shelf = shelf
+        self.tasks = model.get_subtasks(shelf)
+        # task info by row, read a page at a time as rows are shown
+        self.info = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.tasks)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == ShelfTasks.id_role:
+            return self.tasks[row]
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole, ShelfTasks.info_role):
+            return None
+        if row not in self.info:
+            page = range(row, min(row + ShelfTasks.page_size, len(self.tasks)))
+            info = self.model.get_task_info([self.tasks[r] for r in page])
+            self.info.update({r: info[self.tasks[r]] for r in page})
+        if role == ShelfTasks.info_role:
+            return self.info[row]
+        return self.info[row]["label"]
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    # read the tasks of the shelf again, only resetting the rows if they changed
+    def refresh(self):
+        tasks = self.model.get_subtasks(self.shelf)
+        if tasks == self.tasks:
+            self.refresh_rows()
+            return
+        self.beginResetModel()
+        self.tasks = tasks
+        self.info = {}
+        self.endResetModel()
+
+    # redraw rows with the current info of their tasks
+    def refresh_rows(self):
+        self.info = {}
+        if len(self.tasks) != 0:
+            self.dataChanged.emit(self.index(0), self.index(len(self.tasks) - 1))
+
+
+class TaskRow(QStyledItemDelegate):
+    # paints the tasks of a virtual shelf as rows, and makes a task widget for the row that is open
+
+    height = 30
+
+    def __init__(self, task_list):
+        super().__init__(task_list)
+        self.task_list = task_list
+
+    def paint(self, painter, option, index):
+        info = index.data(ShelfTasks.info_role)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = option.rect.adjusted(2, 1, -2, -1)
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(rect, option.palette.highlight().color().lighter(170))
+        painter.setPen(Qt.black)
+        painter.drawRect(rect)
+        # done button
+        painter.setPen(Qt.gray)
+        painter.setBrush(QColor("green") if info["completed"] else QColor("white"))
+        painter.drawEllipse(QRect(rect.right() - 25, rect.center().y() - 9, 18, 18))
+        # title
+        text_rect = rect.adjusted(20, 0, -32, 0)
+        painter.setPen(Qt.black)
+        painter.drawText(text_rect, Qt.AlignVCenter | Qt.AlignLeft,
+                         option.fontMetrics.elidedText(str(info["label"]), Qt.ElideRight, text_rect.width()))
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        if self.task_list.editor is not None and self.task_list.open_index == index:
+            return self.task_list.editor.sizeHint()
+        return QSize(option.rect.width(), TaskRow.height)
+
+    def createEditor(self, parent, option, index):
+        editor = self.task_list.view.controller.assemble_tree(index.data(ShelfTasks.id_role), True)
+        editor.set_owner(self.task_list.shelf)
+        editor.setParent(parent)
+        self.task_list.editor = editor
+        if self.task_list.shelf.live:
+            self.task_list.view.register_tree(editor)
+        return editor
+
+    def destroyEditor(self, editor, index):
+        if editor.live:
+            self.task_list.view.unregister_tree(editor)
+        if self.task_list.editor is editor:
+            self.task_list.editor = None
+        editor.deleteLater()
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(option.rect)
+
+    # edits to the open task go through the controller like edits to any other task widget
+    def setEditorData(self, editor, index):
+        pass
+
+    def setModelData(self, editor, model, index):
+        pass
+
+
+class TaskList(QListView):
+    # painted task rows of a virtual shelf, where a row opens into a task widget when double clicked
+
+    def __init__(self, view, shelf, tasks):
+        super().__init__()
+        self.view = view
+        self.shelf = shelf
+        # task widget of the open row, and the row it is open for
+        self.editor = None
+        self.open_index = None
+
+        self.setModel(tasks)
+        self.setItemDelegate(TaskRow(self))
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setDragEnabled(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setMinimumHeight(10 * TaskRow.height)
+
+        self.doubleClicked.connect(self.open_row)
+
+    # open a task widget for a row, closing the one open before
+    def open_row(self, index):
+        self.close_row()
+        self.open_index = QPersistentModelIndex(index)
+        self.openPersistentEditor(index)
+        self.itemDelegate().sizeHintChanged.emit(index)
+
+    def close_row(self):
+        if self.open_index is not None and self.open_index.isValid():
+            index = QModelIndex(self.open_index)
+            self.closePersistentEditor(index)
+            self.itemDelegate().sizeHintChanged.emit(index)
+        self.open_index = None
+
+    def keyPressEvent(self, e):
+        if e.key() == Qt.Key_Escape:
+            self.close_row()
+        else:
+            super().keyPressEvent(e)
+
+    # resize the open row when its task widget changes size
+    def viewportEvent(self, e):
+        if e.type() == QEvent.LayoutRequest and self.open_index is not None and self.open_index.isValid():
+            self.itemDelegate().sizeHintChanged.emit(QModelIndex(self.open_index))
+        return super().viewportEvent(e)
+
+    # drag a task widget made for the dragged row
+    def startDrag(self, supported_actions):
+        index = self.currentIndex()
+        if not index.isValid():
+            return
+        b = QApplication.mouseButtons()
+        task = self.view.controller.assemble_tree(index.data(ShelfTasks.id_role), True)
+        task.set_owner(self.shelf)
+        task.adjustSize()
+        task.drag(b if b == Qt.RightButton or b == Qt.MiddleButton else Qt.LeftButton, index.row() + 1)
+
+
 class Rack(QScrollArea):
+    # width given to placeholders of shelves that haven't had a widget yet, that of a shelf holding tasks
+    default_column_width = 292
 
     def __init__(self, view):
         super(QScrollArea, self).__init__()
@@ -897,19 +1296,37 @@ class Rack(QScrollArea):
         self.setWidget(rack_container)
         self.setWidgetResizable(True)
 
+        # give shelf widgets to the columns that come into view
+        self.horizontalScrollBar().valueChanged.connect(lambda: self.view.controller.schedule_rack_update())
+
+    def resizeEvent(self, e):
+        super().resizeEvent(e)
+        self.view.controller.schedule_rack_update()
+
     def add_child(self, child):
         child.set_owner(self)
         self.container_layout.addWidget(child)
+        if isinstance(child, Shelf):
+            self.view.register_tree(child)
 
     def insert_child(self, child, pos):
         child.set_owner(self)
         self.container_layout.insertWidget(pos, child)
+        if isinstance(child, Shelf):
+            self.view.register_tree(child)
 
     def remove_child(self, child):
+        if child.live:
+            self.view.unregister_tree(child)
         child.set_owner(None)
         self.container_layout.removeWidget(child)
         child.setParent(None)
 
+    # move a child to another position, keeping its widget and everything nested in it
+    def move_child(self, child, pos):
+        self.container_layout.removeWidget(child)
+        self.container_layout.insertWidget(pos, child)
+
     def clear(self):
         for i in reversed(range(self.container_layout.count())):
             self.remove_child(self.container_layout.itemAt(i).widget())
@@ -917,9 +1334,51 @@ class Rack(QScrollArea):
     def get_child(self, idx):
         return self.container_layout.itemAt(idx).widget()
 
+    def get_children(self):
+        return [self.container_layout.itemAt(i).widget() for i in range(self.container_layout.count())]
+
+    # make the given widgets the children in order, keeping ones already here and detaching the rest
+    def set_children(self, children):
+        kept = set(children)
+        for w in self.get_children():
+            self.container_layout.removeWidget(w)
+            if w not in kept:
+                if w.live:
+                    self.view.unregister_tree(w)
+                w.set_owner(None)
+                w.setParent(None)
+        for w in children:
+            w.set_owner(self)
+            self.container_layout.addWidget(w)
+            if isinstance(w, Shelf) and not w.live:
+                self.view.register_tree(w)
+
+    # the children that are shelf widgets rather than placeholders
+    def get_shelves(self):
+        return [w for w in self.get_children() if isinstance(w, Shelf)]
+
+    # put a widget in place of a child
+    def replace_child(self, child, new_child):
+        pos = self.container_layout.indexOf(child)
+        self.remove_child(child)
+        self.insert_child(new_child, pos)
+
     def get_index(self, child):
         return self.container_layout.indexOf(child)
 
+    # returns the children at least partly inside, or within margin pixels of, the part of the rack that can be seen
+    # positions are added up from the widths of the children so they are right before the rack is laid out again
+    def near_view(self, margin=0):
+        left = self.horizontalScrollBar().value() - margin
+        right = self.horizontalScrollBar().value() + self.viewport().width() + margin
+        near = set()
+        x = self.container_layout.contentsMargins().left()
+        for w in self.get_children():
+            if x < right and x + w.width() > left:
+                near.add(w)
+            x += w.width() + self.container_layout.spacing()
+        return near
+
     # accept dragged shelves or shelf ids
     def dragEnterEvent(self, e):
         if e.mimeData().text()[0] == 's' or isinstance(e.source(), Shelf):
@@ -945,6 +1404,26 @@ class Rack(QScrollArea):
         e.accept()
 
 
+class ShelfPlaceholder(QFrame):
+    # stands in for a rack shelf far from the part of the rack being seen, taking up the same width
+
+    def __init__(self, df_id, width):
+        super().__init__()
+        self.owner = None
+        self.df_id = df_id
+        # placeholders are never registered as being on the board
+        self.live = False
+
+        self.setFixedWidth(width)
+        self.setFrameStyle(QFrame.Panel | QFrame.Plain)
+
+    def set_owner(self, o):
+        self.owner = o
+
+    def get_children(self):
+        return []
+
+
 class Stage(QGroupBox):
 
     def __init__(self, view):
@@ -988,11 +1467,14 @@ class Stage(QGroupBox):
         child.set_owner(self)
         self.container_layout.addWidget(child)
         self.task = child
+        self.view.register_tree(child)
 
     def clear(self):
         if self.task is not None:
+            self.view.unregister_tree(self.task)
             self.task.set_owner(None)
             self.task.setParent(None)
+            self.task = None
 
     # accept dragged tasks or task ids
     def dragEnterEvent(self, e):
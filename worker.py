@@ -0,0 +1,72 @@
+import os
+
+from PyQt5.QtCore import QThread, QCoreApplication, pyqtSignal
+
+from model import Model
+from tood import Cancelled, read_tood, read_binary, atomic_write
+
+
+class BoardJob(QThread):
+    # reads or writes a board on its own thread, reporting progress and stopping early when interrupted
+
+    progressed = pyqtSignal(str, int)  # step being done, percent of it done
+    failed = pyqtSignal(str)  # error message
+    cancelled = pyqtSignal()
+
+    def __init__(self, path, binary):
+        super().__init__()
+
+        self.path = path
+        self.binary = binary
+        # name of the step being done, shown with its progress
+        self.step = ""
+
+    # progress callback for readers and writers, which stops them if the job was interrupted
+    def report(self, done, total):
+        if self.isInterruptionRequested():
+            raise Cancelled()
+        self.progressed.emit(self.step, 100 * done // total if total > 0 else 100)
+
+    def run(self):
+        try:
+            self.work()
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(self.path + " could not be " + self.verb + ": " + str(e))
+
+
+class SaveJob(BoardJob):
+    # writes a snapshot of a board next to its path, and only replaces the board once all of it is on disk
+    # so a cancelled, failed, or crashed save leaves the previous board as it was
+
+    verb = "saved"
+    saved = pyqtSignal(str, bool, int)  # path, if the board is journaled, version of the model saved
+
+    def __init__(self, snapshot, path, binary, journaled):
+        super().__init__(path, binary)
+
+        self.snapshot = snapshot
+        self.journaled = journaled
+
+    def work(self):
+        self.step = "Saving " + os.path.basename(self.path)
+        with atomic_write(self.path) as file:
+            self.snapshot.write(file, self.binary, self.report)
+        self.saved.emit(self.path, self.journaled, self.snapshot.version)
+
+
+class LoadJob(BoardJob):
+    # reads a board and builds a whole model from it, handed over to the gui thread when it is finished
+
+    verb = "loaded"
+    loaded = pyqtSignal(object)  # model
+
+    def work(self):
+        self.step = "Reading " + os.path.basename(self.path)
+        contents = (read_binary if self.binary else read_tood)(self.path, self.report)
+        self.step = "Building board"
+        board = Model()
+        board.load_contents(contents, self.path, self.report)
+        board.moveToThread(QCoreApplication.instance().thread())
+        self.loaded.emit(board)